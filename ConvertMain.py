@@ -9,11 +9,20 @@ import cwa_metadata as CWA   # cwa file type converter
 import rFilter
 import rIntegrate
 import rapidCWA as rCWA  # Rapid cwa file loader
+import rIndex  # Cached per-file sector index
+import rFleet  # Concurrent scan of all the logger files
 import rInterpolate as rInter  # Rapid interpolator
+import rStream  # Out-of-core conversion
+import rPrefetch  # Read-ahead of the next logger files
+import rResample  # Polyphase resampler
 import bin_data as BIN  # bin file type converter
+import Multithread  # Shared per-channel thread pool
 
+import argparse
+import multiprocessing
 import os.path
 import time
+from concurrent.futures import ProcessPoolExecutor
 from multiprocessing import freeze_support
 
 import Resampler as Resampler
@@ -21,11 +30,13 @@ import Resampler as Resampler
 from datetime import datetime
 
 # Global Vars
-NUM_THREADS: int = 4
+NUM_THREADS: int = os.cpu_count() or 4
 MULTITHREAD: bool = True
 RESAMPLE: bool = True
 RESAMPLE_FREQ: float = 800.0
 OUTPUT_DATA_WIDTH: int = 4
+TRIM_MARGIN_SECONDS: float = 2.0  # Extra data read either side of a trimmed resample range
+IN_MEMORY_COPIES: int = 5  # Copies of a logger's samples alive at once when it is processed in memory
 
 
 def compute_multi_channel(listLoggerFiles, outputFile,
@@ -33,7 +44,10 @@ def compute_multi_channel(listLoggerFiles, outputFile,
                           lowpass=False, lowpass_freq=100.0,
                           integrate=False, high1_freq=1.0, high2_freq=1.0,
                           trimStart=0, trimEnd=0,
-                          demoRun = False, byteWidth=OUTPUT_DATA_WIDTH, getFreq=False):
+                          demoRun = False, byteWidth=OUTPUT_DATA_WIDTH, getFreq=False, gaps='fill',
+                          sensors=None, maxMemory=None, numThreads=NUM_THREADS, numProcesses=1,
+                          prefetchMemory=rPrefetch.PREFETCH_MEMORY, resampleTiming='anchors',
+                          resampleEngine='auto'):
     """ Operates on many loggers
     Each physical logger has three (or more) accelerometer channels and as such will command THREE channels in the output
     @:param
@@ -42,52 +56,60 @@ def compute_multi_channel(listLoggerFiles, outputFile,
 
         demoRun = if the function will calculate only the resample range and then exit
         getFreq = if the function will calculate only the average sampling frequency of loggers and exit
+        gaps = how gaps and restarts within a logger are handled, 'fill' holds the last sample over the gap,
+            'join' joins the data end to end, 'split' writes each continuous segment as its own set of channels (not
+            resampled only, resampled output is always filled to keep every logger on the same time base)
+        sensors = which sensors of each logger to convert, a list of 'accel', 'gyro' and/or 'mag', None for all of them.
+            Unselected axes are never decoded, processed or written
+        maxMemory = stream each logger through the conversion in blocks to stay within this many bytes (or a size such
+            as "2G"), None to process each logger as a whole in memory
+        numThreads = the number of threads the channels of a logger are filtered, resampled and integrated on
+        numProcesses = convert up to this many loggers at once in separate processes, limited by the free memory
+        prefetchMemory = read up to this many bytes (or a size such as "1G") of the next logger files while one is
+            converted, 0 or None to read each file only when it is converted
+        resampleTiming = 'anchors' resamples against the time of every sample from the sector timestamps, so clock
+            drift within a file does not build up and every logger lands on the same get_range grid. 'linear' spreads
+            the samples read evenly between their first and last time
+        resampleEngine = 'linear' lowpass filters (if lowpass) and then interpolates linearly, 'poly' resamples with a
+            polyphase FIR filter (see rResample) that also does the anti-aliasing, with a cutoff of lowpass_freq if
+            lowpass, and always corrects drift from the sector timestamps. 'auto' replaces the lowpass filter and linear
+            interpolation with the multistage decimator of rResample.decimate, which has the same cutoff and stopband
+            as 'poly', when lowpass is set and the nominal rate of a logger is a large enough whole multiple of the
+            resample rate (see resample_engine), and is 'linear' otherwise, so output that is not lowpass filtered is
+            never filtered. Streamed conversion is always 'linear', so it only matches an in-memory conversion with
+            'linear'
     """
     # Order the logger files in numerical Order
     freeze_support()
     listLoggerFiles.sort()
+    Multithread.set_threads(numThreads)
 
-    # Each file is a different logger, get and add its three channels
-    loggers = []
+    # Each file is a different logger, get and add its three channels. All the files are scanned concurrently
+    (fleet, loggers) = rFleet.scan_fleet(listLoggerFiles)
     channel_list = []
 
     # Some limit holders to determine out of place loggers (too short duration, diff sample rate etc)
-    samples = {"max":0, "maxLogger":"", "min":1e100, "minLogger":"", "average":0.0, "numLoggers":0}
-    rate = {"max":0, "maxLogger":"", "min":1e100, "minLogger":"", "average":0.0, "numLoggers":0}
-    startTime = {"max":0, "maxLogger":"", "min":1e100, "minLogger":"", "average":0.0, "numLoggers":0}
-    stopTime = {"max":0, "maxLogger":"", "min":1e100, "minLogger":"", "average":0.0, "numLoggers":0}
-    channels = {"max": 0, "maxLogger": "", "min": 1e100, "minLogger": "", "average": 0.0, "numLoggers": 0}
-
-    for loggerPath in listLoggerFiles:
-        # Get the header, file info, and first and last sectors or each logger
-        loggerData = CWA.cwa_info(loggerPath, extract=True)
-        # Add the file path to the summary set
-        loggerData['filePath'] = loggerPath
-        # Add the loggerData to the list of loggers
-        loggers.append(loggerData)
-
-        # Unused currently, perform some min, max, mean calculations across all loggers
-        update_dictionary(loggerPath, loggerData['file']['numSamples'], samples)
-        update_dictionary(loggerPath, loggerData['file']['meanRate'], rate)
-        update_dictionary(loggerPath, loggerData['first']['timestamp'], startTime)
-        update_dictionary(loggerPath, loggerData['last']['timestamp'], stopTime)
-        update_dictionary(loggerPath, loggerData['first']['channels'], channels)
-
-    #summary = {"sampels":samples, "rate":rate, "channels":channels, "startTime":startTime, "stopTime":stopTime}
-
-    # Perform checks and conditions to eliminate loggers who fall outside the appropriate range (Unused)
-    if logger_out_of_range(10000, samples): print("[WARN]: Logger has samples out of range", samples)
-    if logger_out_of_range(20, rate): print("[WARN]: Logger has sampling freq. out of range", rate)
-    if logger_out_of_range(10000, startTime): print("[WARN]: Logger has start time out of range", startTime)
-    if logger_out_of_range(10000, stopTime): print("[WARN]: Logger has end time out of range (>10000)", stopTime)
-    if logger_out_of_range(1, stopTime): print("[WARN]: Logger has end time out of range (<1)", channels)
+    samples = rFleet.summary(fleet, 'numSamples')
+    rate = rFleet.summary(fleet, 'rate')
+    startTime = rFleet.summary(fleet, 'startTime')
+    stopTime = rFleet.summary(fleet, 'stopTime')
+    channels = rFleet.summary(fleet, 'channels')
+
+    # Perform checks and conditions to find loggers who fall outside the appropriate range
+    checks = [('numSamples', 10000, "samples"), ('rate', 20, "sampling freq."), ('startTime', 10000, "start time"),
+              ('stopTime', 10000, "end time"), ('channels', 1, "number of channels")]
+    for (column, limit, description) in checks:
+        for loggerPath in fleet['filePath'][rFleet.outliers(fleet, column, limit)]:
+            print("[WARN]: Logger has " + description + " out of range", loggerPath)
 
     # Quick and nasty way to get the rate of all the loggers, Next version should abstract out this code
     if getFreq:
         return (0, 0, 0, rate)
 
     # Get resample ranges
-    (rzStart, rzStop, rzSamples) = Resampler.get_range(startTime, stopTime, resample_freq, trimStart, trimEnd)
+    # The exact grid of every resampled sample, in whole nanoseconds
+    grid = Resampler.get_grid(startTime, stopTime, resample_freq, trimStart, trimEnd)
+    (rzStart, rzStop, rzSamples) = (grid.start, grid.stop, grid.numSamples)
 
     # Return this function early if the GUI requires a trim time only
     if demoRun:
@@ -97,42 +119,53 @@ def compute_multi_channel(listLoggerFiles, outputFile,
 
     # Set up the names of the logger channels depending on the number of channels of the max logger
     #   Currently not supported mixing and matching of loggers with different numbers of channels
-    axis = ['X', 'Y', 'Z']  # Update this if the logger has more than 3 channels to extract
-    if channels['max'] == 6: axis = ["Ax", "Ay", "Az", "Gx", "Gy", "Gz"]
-    if channels['max'] == 9: axis = ["Ax", "Ay", "Az", "Gx", "Gy", "Gz", "Mx", "My", "Mz"]
+    #   AX6 and AX9 loggers store the gyro axes first, then the accelerometer and magnetometer
+    (axes, axis) = rCWA.select_axes(channels['max'], sensors)
+    if len(axes) == 0:
+        print("Error: none of the selected sensors", sensors, "are in the logger files")
+        return
 
     loggerOffsets = []
     loggerOffsets.append(0)
 
+    # Each logger is written as one or more parts of (segment, numSamples, beginTime, endTime, name suffix)
+    loggerParts = []
+
     # For each of the loggers (.cwa files), get the header details and place it into a header for the BIN format
     for logger in loggers:
         # Logger stats
-        loggerId = str(logger['header']['deviceId'])
-        sessionId = str(logger['header']['sessionId'])
-        sampleRate = str(logger['file']['meanRate'])
-        numSamples = logger['file']['numSamples']
-        beginTime = logger['first']['timestamp']
-        endTime = logger['last']['timestamp']
-        numChannelsPerLogger = channels['max']
+        loggerId = str(logger.deviceId)
+        sessionId = str(logger.sessionId)
+        sampleRate = str(logger.meanRate)
+        beginTime = logger.startTime
+        endTime = logger.stopTime
+        numChannelsPerLogger = len(axes)
 
         if resample:
             sampleRate = resample_freq
-            numSamples = rzSamples
-            beginTime = rzStart
-            endTime = rzStop
-
-        if integrate:
-            logger
+            parts = [(None, rzSamples, rzStart, rzStop, "")]
+        else:
+            # A straight conversion writes exactly the sectors that the reader will produce after gap handling
+            samplesPerSector = logger.samplesPerSector
+            segments = rCWA.readSegments(logger.filePath, loggerInfo=logger, index=rIndex.sector_index(logger.filePath))
+            if gaps == 'split':
+                parts = [(k, int(seg['numSectors']) * samplesPerSector, seg['startTime'], seg['stopTime'],
+                          "_seg" + str(k)) for k, seg in enumerate(segments)]
+            else:
+                numSectors = segments['numSectors'].sum() + (segments['gapSectors'].sum() if gaps == 'fill' else 0)
+                parts = [(None, int(numSectors) * samplesPerSector, beginTime, endTime, "")]
+        loggerParts.append(parts)
 
         # generate a Channel object for each channel
-        for i in range(numChannelsPerLogger):
-            channelName = loggerId + "_" + sessionId + "_" + axis[i]
-            channel_object = BIN.Channel(loggerPath, channelName, "[no comment]", loggerId, sessionId, numSamples, sampleRate, beginTime, endTime)
-            channel_list.append(channel_object)
+        for (_, numSamples, beginTime, endTime, suffix) in parts:
+            for i in range(numChannelsPerLogger):
+                channelName = loggerId + "_" + sessionId + suffix + "_" + axis[i]
+                channel_object = BIN.Channel(logger.filePath, channelName, "[no comment]", loggerId, sessionId, numSamples, sampleRate, beginTime, endTime,
+                                             grid=grid if resample else None)
+                channel_list.append(channel_object)
 
-        # When writing out the data file, need to know exact position of data (either scaled or not)
-        extras = 0 if byteWidth != 2 else 16
-        loggerOffsets.append(loggerOffsets[-1] + numSamples * numChannelsPerLogger * byteWidth + extras)
+            # When writing out the data file, need to know exact position of data (either scaled or not)
+            loggerOffsets.append(loggerOffsets[-1] + numChannelsPerLogger * BIN.channel_bytes(numSamples, byteWidth))
 
     # Manipulate file paths
     base = os.path.basename(outputFile)
@@ -142,10 +175,16 @@ def compute_multi_channel(listLoggerFiles, outputFile,
     # Write the comment that will appear at the top of the catman test entry. This is a fast indication of if the
     #   set of channels were resampled or not
     comment = "Resampled"
+    engines = set([resample_engine(resampleEngine, nominal_freq(logger), resample_freq, lowpass) for logger in loggers])
     if resample:
         comment += " @" + str(resample_freq) + "Hz."
         if lowpass:
             comment += " Lowpass@" + str(lowpass_freq) + "Hz"
+        # Streamed conversion always resamples linearly
+        if 'decimate' in engines and maxMemory is None:
+            comment += " FIR decimation."
+        elif 'poly' in engines and maxMemory is None:
+            comment += " Polyphase FIR."
     else: comment = "Not resampled."
 
     if integrate:
@@ -156,54 +195,58 @@ def compute_multi_channel(listLoggerFiles, outputFile,
 
     print("Saving output file to", dirname + "/")
 
-    # Write the file header and channel headers
+    # Write the file header and channel headers, the data block is allocated at its full size up front so that the data
+    #   can be written in any order
     outputPath = dirname + "/" + base + ".bin"
-    f = open(outputPath, "wb")
-    f.write(header)
-    f.write(channelHeaders)
-    lastFilePos = f.tell()  # Save the last position in file to continue writing data channels to
-    f.flush()
-    f.close()
+    lastFilePos = BIN.create_BIN(outputPath, header, channelHeaders, channel_list, byteWidth)
+
+    # Every part of every logger has its own fixed range of the data block, so loggers can be converted in any order or
+    #   at the same time by separate processes
+    dataStart = lastFilePos
+    settings = {'outputPath': outputPath, 'axes': axes, 'axis': axis, 'byteWidth': byteWidth, 'gaps': gaps,
+                'resample': resample, 'resample_freq': resample_freq, 'rzStart': rzStart, 'rzStop': rzStop, 'grid': grid,
+                'lowpass': lowpass, 'lowpass_freq': lowpass_freq,
+                'integrate': integrate, 'high1_freq': high1_freq, 'high2_freq': high2_freq,
+                'trimmed': trimStart > 0 or trimEnd > 0, 'maxMemory': maxMemory, 'timing': resampleTiming,
+                'engine': resampleEngine}
+    if resample and maxMemory is not None:
+        if engines != {'linear'}:
+            print("[WARN]: Streamed conversion resamples linearly rather than with",
+                  "/".join(sorted(engines - {'linear'})), "as an in-memory conversion would, the outputs will differ")
+    jobs = []
+    firstPart = 0
+    for (logger, parts) in zip(loggers, loggerParts):
+        offsets = [dataStart + offset for offset in loggerOffsets[firstPart:firstPart + len(parts)]]
+        jobs.append((logger, parts, offsets, settings))
+        firstPart += len(parts)
 
-    # Multithreading disabled for now -
-    #   Instead use linear rapidCWA methods that are faster in series than old methods in parallel
     startTimeT = time.time()
 
-    # # Data Processing, one logger at a time # #
-    for i, logger in enumerate(loggers):    # New and improved reading, resampling and output
-        fp = logger['filePath']
-        print("")  # Blank Display Line
-        # Read the data only for this logger to RAM array. This used to either resample or convert direct
-        masterArray = rCWA.readToMem(fp, loggerInfo=logger, cols=axis)
-        print(" Loaded ", masterArray.shape[0], " channels.", masterArray.shape[1], "samples each.")
-
-        original_freq = float(logger['file']['meanRate'])
-
-        # If the resample option was selected, first resample the data before outputting it to the file
-        if resample:
-            startVal = float(logger['first']['timestamp'])
-            endVal = float(logger['last']['timestamp'])
-            # Update the array in overwrite mode to contain the new resampled data
-            if lowpass:
-                print("Lowpass filtering at", lowpass_freq)
-                masterArray = rFilter.lowpass_filter(masterArray, in_freq=original_freq, cutoff_freq=lowpass_freq)
-            masterArray = rInter.interp1d(masterArray, startVal, endVal, rzStart, rzStop, 1 / resample_freq)
-
-        if integrate:
-            input_freq = original_freq if not resample else resample_freq
-            print("Integrating at", input_freq, "Hz")
-            print("Begin highpass Filtering at", high1_freq, "Hz")
-            masterArray = rFilter.highpass_filter(masterArray, order=8, in_freq=input_freq, cutoff_freq=high1_freq)
-            print("Begin integration")
-            masterArray = rIntegrate.integrate_data(masterArray, frequency=input_freq)
-            print("Begin highpass filtering at", high2_freq, "Hz")
-            masterArray = rFilter.highpass_filter(masterArray, order=8, in_freq=input_freq, cutoff_freq=high2_freq)
-
-        # Output the data for this logger to file and save the last position in file
-        output_samples = masterArray.shape[1] if not resample else rzSamples
-        lastFilePos = rCWA.writeToFile(masterArray, filePath=outputPath, loggerInfo=logger, offsetBytes=lastFilePos,
-                                       sizeBytes=byteWidth, samples=output_samples)
-        if len(loggers) > 1: print("\n COMPLETED", (i+1), "OF", len(loggers), "FILES")
+    # # Data Processing, one logger at a time or one logger per process # #
+    if maxMemory is not None:
+        bytesPerLogger = rStream.parse_memory(maxMemory)
+    else:
+        bytesPerLogger = samples['max'] * len(axes) * 8 * IN_MEMORY_COPIES
+    numWorkers = Multithread.process_limit(numProcesses, bytesPerLogger, len(jobs))
+
+    if numWorkers > 1:
+        print("Converting", len(jobs), "loggers on", numWorkers, "processes")
+        # Spawned rather than forked, a forked child would inherit a copy of the parent's thread pool with no threads
+        with ProcessPoolExecutor(max_workers=numWorkers, mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=Multithread.set_threads, initargs=(max(1, numThreads // numWorkers),)) as pool:
+            for i, _ in enumerate(pool.map(convert_logger, jobs)):
+                print("\n COMPLETED", (i+1), "OF", len(loggers), "FILES")
+    else:
+        # One writer for the whole run, so each logger is read and processed while the last is still being written,
+        #   and the next files are read ahead while it is processed
+        prefetchBytes = rStream.parse_memory(prefetchMemory) if prefetchMemory else 0
+        with BIN.WriteBehind(outputPath) as writer, \
+                rPrefetch.Prefetcher([job[0].filePath for job in jobs], prefetchBytes,
+                                     locate=lambda i: job_bytes(jobs[i])) as prefetch:
+            for i, job in enumerate(jobs):
+                prefetch.advance(i)
+                convert_logger(job, writer)
+                if len(loggers) > 1: print("\n COMPLETED", (i+1), "OF", len(loggers), "FILES")
 
     # Relay to the user how long the execution for all files took.
     deltaT = time.time() - startTimeT
@@ -219,31 +262,120 @@ def compute_multi_channel(listLoggerFiles, outputFile,
     print(" These windows may now be closed. ")
 
 
-def update_dictionary(logger, stat, dict):
-    """Update the logger dictionary for the given statistic"""
-    count = dict['average'] * dict['numLoggers']
-    numLoggers = dict['numLoggers'] + 1
+def nominal_freq(logger):
+    """ The sample rate a logger was configured for, its mean rate if that is unknown"""
+    return float(logger.sampleRate or logger.meanRate)
+
+
+def resample_engine(engine, in_freq, resample_freq, lowpass):
+    """ The resampling an in-memory conversion uses for a logger at a nominal in_freq Hz with the resampleEngine and
+        lowpass of compute_multi_channel, 'decimate', 'poly' or 'linear'. 'auto' only decimates in place of the lowpass
+        filter, the decimator filters whatever it is given"""
+    if engine == 'auto':
+        return 'decimate' if lowpass and rResample.decimation_stages(in_freq, resample_freq) else 'linear'
+    return engine
+
+
+def read_window(settings):
+    """ The (startTime, stopTime) window of each logger that is read, None for the whole file. When resampling, only
+        the resample range plus enough extra for the lowpass filter to settle is read"""
+    if not settings['resample']:
+        return None
+    margin = TRIM_MARGIN_SECONDS
+    if settings['lowpass']:
+        margin = max(margin, rFilter.transient_seconds(8, settings['lowpass_freq']))
+    return (settings['rzStart'] - margin, settings['rzStop'] + margin)
+
+
+def job_bytes(job):
+    """ The (start, stop) byte range of the logger file of a convert_logger job that is read"""
+    (logger, _, _, settings) = job
+    return rCWA.window_bytes(logger.filePath, logger, read_window(settings))
+
+
+def convert_logger(job, writer=None):
+    """ Reads, processes and writes every part of one logger into its own place in the BIN file.
+        job = (logger, parts, offsets, settings), the LoggerInfo record, its (segment, numSamples, ...) parts, the file
+        offset of each part and the conversion settings of compute_multi_channel
+        writer = the bin_data.WriteBehind to write through, default one of its own that is finished before returning"""
+    (logger, parts, offsets, settings) = job
+    if writer is None:
+        with BIN.WriteBehind(settings['outputPath']) as writer:
+            return convert_logger(job, writer)
+    fp = logger.filePath
+    (axes, axis, byteWidth, outputPath) = (settings['axes'], settings['axis'], settings['byteWidth'], settings['outputPath'])
+    (resample, resample_freq, rzStart, rzStop) = (settings['resample'], settings['resample_freq'], settings['rzStart'],
+                                                  settings['rzStop'])
+    (lowpass, lowpass_freq) = (settings['lowpass'], settings['lowpass_freq'])
+    (integrate, high1_freq, high2_freq) = (settings['integrate'], settings['high1_freq'], settings['high2_freq'])
+    maxMemory = settings['maxMemory']
+
+    readGaps = 'join' if settings['gaps'] == 'join' and not resample else 'fill'
+    # Index the whole file unless only a trimmed window of it is going to be read
+    index = rIndex.sector_index(fp, build=not (resample and settings['trimmed']))
+    for ((segment, partSamples, _, _, _), offset) in zip(parts, offsets):
+        print("")  # Blank Display Line
+        window = read_window(settings)
+
+        if maxMemory is not None:
+            # Out-of-core, the same steps as below one block at a time
+            rStream.convert_logger(
+                fp, logger, outputPath, offset, partSamples, axes, axis, rStream.parse_memory(maxMemory),
+                sizeBytes=byteWidth, gaps=readGaps, segment=segment, window=window, index=index,
+                resample=settings['grid'] if resample else None,
+                lowpass_freq=lowpass_freq if resample and lowpass else None,
+                highpass_freqs=(high1_freq, high2_freq) if integrate else None, writer=writer,
+                timing=settings['timing'])
+            continue
 
-    count += stat
-    average = count / numLoggers
-    dict['average'] = average
-    dict['numLoggers'] = numLoggers
+        # Read the data only for this logger to RAM array. This used to either resample or convert direct
+        masterArray = rCWA.readToMem(fp, loggerInfo=logger, cols=axis, gaps=readGaps, segment=segment, window=window,
+                                     index=index, axes=axes)
+        print(" Loaded ", masterArray.shape[0], " channels.", masterArray.shape[1], "samples each.")
 
-    if stat > dict['max']:
-        dict['max'] = stat
-        dict['maxLogger'] = logger
-    if stat < dict['min']:
-        dict['min'] = stat
-        dict['minLogger'] = logger
+        original_freq = float(logger.meanRate)
 
+        # If the resample option was selected, first resample the data before outputting it to the file
+        if resample:
+            # Start and end of the logger from the reconstructed sector timestamps rather than the raw first and last
+            #   sector RTC values, endVal being the time of the sample one past the end of the array
+            (anchorIndex, anchorTime) = rCWA.readAnchors(fp, loggerInfo=logger, window=window, index=index)
+            (startVal, endVal) = rCWA.sample_times(anchorIndex, anchorTime, [0, masterArray.shape[1]])
+            # Update the array in overwrite mode to contain the new resampled data
+            in_freq = nominal_freq(logger)
+            engine = resample_engine(settings['engine'], in_freq, resample_freq, lowpass)
+            if engine == 'decimate':
+                # A whole number of input samples per output sample, decimate in stages
+                masterArray = rResample.decimate(masterArray, anchorIndex, anchorTime, settings['grid'], in_freq,
+                                                 lowpass_freq=lowpass_freq if lowpass else None)
+            elif engine == 'poly':
+                # Anti-aliasing, rate change and drift correction in one pass from the nominal rate of the logger
+                masterArray = rResample.resample(masterArray, anchorIndex, anchorTime, settings['grid'], in_freq,
+                                                 lowpass_freq=lowpass_freq if lowpass else None)
+            else:
+                if lowpass:
+                    print("Lowpass filtering at", lowpass_freq)
+                    masterArray = rFilter.lowpass_filter(masterArray, in_freq=original_freq, cutoff_freq=lowpass_freq)
+                if settings['timing'] == 'anchors':
+                    masterArray = rInter.interp_anchored(masterArray, anchorIndex, anchorTime, settings['grid'],
+                                                         1 / original_freq)
+                else:
+                    masterArray = rInter.interp1d(masterArray, startVal, endVal, rzStart, rzStop, 1 / resample_freq,
+                                                  outputSamples=partSamples)
 
-def logger_out_of_range(absDiffLimit, dictionary):
-    """ A function to return if one of the values for all the loggers is out of bounds"""
-    diff = max((dictionary['max'] - dictionary['average']), (dictionary['average'] - dictionary['min']))
-    if diff > absDiffLimit:
-        return True
-    else:
-        return False
+        if integrate:
+            input_freq = original_freq if not resample else resample_freq
+            print("Integrating at", input_freq, "Hz")
+            print("Begin highpass Filtering at", high1_freq, "Hz")
+            masterArray = rFilter.highpass_filter(masterArray, order=8, in_freq=input_freq, cutoff_freq=high1_freq)
+            print("Begin integration")
+            masterArray = rIntegrate.integrate_data(masterArray, frequency=input_freq)
+            print("Begin highpass filtering at", high2_freq, "Hz")
+            masterArray = rFilter.highpass_filter(masterArray, order=8, in_freq=input_freq, cutoff_freq=high2_freq)
+
+        # Output the data for this part of the logger to its place in the file
+        rCWA.writeToFile(masterArray, filePath=outputPath, loggerInfo=logger, offsetBytes=offset, sizeBytes=byteWidth,
+                         samples=partSamples, axes=axes, writer=writer)
 
 
 def write_tst_convert(filePath, channel_list):
@@ -276,3 +408,39 @@ def write_tst_resampled(filePath, channel_list):
 
     f.write("DATAFILE=" + str(filePath) + ".BIN")
     f.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert OpenMovement .cwa logger files to a catman .BIN file")
+    parser.add_argument("files", nargs="+", help="the .cwa logger files to convert")
+    parser.add_argument("-o", "--output", required=True, help="the output file path, with no extension")
+    parser.add_argument("--no-resample", dest="resample", action="store_false", help="convert the samples as recorded")
+    parser.add_argument("--resample-freq", type=float, default=RESAMPLE_FREQ, help="resample rate in Hz")
+    parser.add_argument("--lowpass", type=float, default=None, metavar="FREQ", help="lowpass before resampling")
+    parser.add_argument("--integrate", nargs=2, type=float, default=None, metavar=("HIGH1", "HIGH2"),
+                        help="integrate to mm/s between highpass filters at these frequencies")
+    parser.add_argument("--trim-start", type=float, default=0, help="seconds trimmed from the start")
+    parser.add_argument("--trim-end", type=float, default=0, help="seconds trimmed from the end")
+    parser.add_argument("--width", type=int, choices=[2, 4, 8], default=OUTPUT_DATA_WIDTH, help="bytes per sample")
+    parser.add_argument("--gaps", choices=['fill', 'join', 'split'], default='fill')
+    parser.add_argument("--sensors", nargs="+", choices=['accel', 'gyro', 'mag'], default=None)
+    parser.add_argument("--max-memory", default=None, help="stream the conversion within this much memory, eg. 2G")
+    parser.add_argument("--threads", type=int, default=NUM_THREADS, help="threads used to process the channels")
+    parser.add_argument("--processes", type=int, default=1, help="loggers converted at once in separate processes")
+    parser.add_argument("--resample-timing", choices=['anchors', 'linear'], default='anchors',
+                        help="resample against the sector timestamps, or the mean rate of each file")
+    parser.add_argument("--resample-engine", choices=['auto', 'linear', 'poly'], default='auto',
+                        help="lowpass and linear interpolation, polyphase FIR resampling, or auto to decimate whole "
+                             "multiples of the resample rate when lowpass filtering and otherwise interpolate")
+    parser.add_argument("--prefetch-memory", default=str(rPrefetch.PREFETCH_MEMORY),
+                        help="read up to this much of the next files ahead while converting, eg. 1G, 0 for none")
+    args = parser.parse_args()
+
+    compute_multi_channel(args.files, args.output, resample=args.resample, resample_freq=args.resample_freq,
+                          lowpass=args.lowpass is not None, lowpass_freq=args.lowpass or 100.0,
+                          integrate=args.integrate is not None,
+                          high1_freq=(args.integrate or [1.0, 1.0])[0], high2_freq=(args.integrate or [1.0, 1.0])[1],
+                          trimStart=args.trim_start, trimEnd=args.trim_end, byteWidth=args.width, gaps=args.gaps,
+                          sensors=args.sensors, maxMemory=args.max_memory, numThreads=args.threads,
+                          numProcesses=args.processes, prefetchMemory=args.prefetch_memory,
+                          resampleTiming=args.resample_timing, resampleEngine=args.resample_engine)
@@ -9,6 +9,8 @@ from tkinter import filedialog
 
 import ConvertMain
 import cwa_metadata as CWA
+import rFilter
+import rResample
 
 import os.path
 import threading
@@ -41,7 +43,7 @@ class PrefForm():
         self.highpass2_freq = tk.DoubleVar(value=1.0)
 
         self.multithread: bool = False
-        self.numThreads: int = 4
+        self.numThreads: int = ConvertMain.NUM_THREADS
         self.byteWidth: int = 8
 
         # The main frame for the GUI
@@ -129,6 +131,8 @@ class PrefForm():
         self.filter_enable.grid(row=1, column=0, pady=1)
         self.filter_f_select = tk.Entry(self.resample_frame2, borderwidth=2, width=10, textvariable=self.lowpass_freq, justify=tk.RIGHT)
         self.filter_f_select.grid(row=1, column=1, sticky='w')
+        self.filterText = tk.Label(self.resample_frame2, text="Filter Response: N/A", anchor='w')
+        self.filterText.grid(row=2, column=0, columnspan=2, sticky='w')
 
         # Trim selection options
         self.trimStartLabel = tk.Label(self.resample_frame2, text="Trim Start (decimal minutes)  ", width = 25, anchor='e', justify=tk.RIGHT)
@@ -196,6 +200,15 @@ class PrefForm():
         self.byteDropDown = tk.OptionMenu(self.out_format_frame, self.bytesVar, "8 Byte", "4 Byte", "2 Byte", command=self.byteSelect)
         self.byteDropDown.pack(side=tk.TOP, anchor=tk.N, padx= 10, pady=1)
 
+        # Number of cores the channels of each logger are filtered and resampled on
+        self.paraLabel = tk.Label(self.out_format_frame, text="Parallel Cores")
+        self.paraLabel.pack(side=tk.TOP, anchor=tk.N, padx=10, pady=1)
+        self.paraCores = tk.Spinbox(self.out_format_frame, from_=1, to=max(os.cpu_count() or 1, self.numThreads),
+                                    width=5, justify=tk.RIGHT, borderwidth=2)
+        self.paraCores.delete(0, "end")
+        self.paraCores.insert(0, str(self.numThreads))
+        self.paraCores.pack(side=tk.TOP, anchor=tk.N, padx=10, pady=1)
+
         # Now get file output from user
         self.out_file_sep = ttk.Separator(self.out_file_frame)
         self.out_file_sep.pack(side=tk.TOP, fill=tk.X, expand=True, pady=1)
@@ -331,6 +344,35 @@ class PrefForm():
         if mode == 2:
             toggle_state = self.lowpass.get()
             self.filter_f_select.configure(state='disabled' if not toggle_state else 'normal')
+        self.update_filter_response()
+
+    def update_filter_response(self):
+        '''Show the gain of the anti-aliasing filter that the conversion will use at its cutoff and at the Nyquist
+        frequency of the resampled output'''
+        output = "Filter Response: N/A"
+        try:
+            lowpass_freq = self.lowpass_freq.get()
+            resample_freq = self.resample_freq.get()
+            in_freq = float(getattr(self, 'max_logger_rate', 0.0))
+        except (tk.TclError, ValueError):
+            lowpass_freq = resample_freq = in_freq = 0.0
+
+        lowpass = self.lowpass.get() and 0 < lowpass_freq < in_freq / 2
+        engine = ConvertMain.resample_engine('auto', in_freq, resample_freq, lowpass) if resample_freq > 0 else 'linear'
+        gains = None
+        if self.resample.get() and engine != 'linear':
+            # Lowpass filtering to a whole multiple of the resample rate decimates, with its own FIR filter
+            cutoff_freq = rResample.cutoff(in_freq, resample_freq, lowpass_freq)
+            gains = [(freq, rResample.gain_at(freq, in_freq, resample_freq, lowpass_freq, engine))
+                     for freq in (cutoff_freq, resample_freq / 2)]
+        elif self.resample.get() and lowpass and resample_freq > 0:
+            # Designs and responses are cached in rFilter, so each setting is only computed once
+            gains = [(freq, rFilter.gain_at(freq, 'lowpass', 8, lowpass_freq, in_freq))
+                     for freq in (lowpass_freq, resample_freq / 2)]
+        if gains is not None:
+            output = "Filter Response: " + str(round(gains[0][1], 1)) + " dB @ " + str(round(gains[0][0], 2)) + \
+                     " Hz,  " + str(round(gains[1][1], 1)) + " dB @ " + str(resample_freq / 2) + " Hz"
+        self.filterText.config(text=output)
 
     def update_integrate_check(self):
         integrate = self.integrate.get()
@@ -376,6 +418,7 @@ class PrefForm():
 
         output = "Start Time:     " + start + "\nFinish Time:   " + end + "\nSamples:        " + str(numSamples)
         self.trimText.config(text=output)
+        self.update_filter_response()
 
     def confirm(self):
         '''Function called when it is time to actually convert the files. This will create a new parallel thread and
@@ -410,7 +453,9 @@ class PrefForm():
             integrate = self.integrate.get()
             high1 = self.highpass1_freq.get()
             high2 = self.highpass2_freq.get()
-        except tk.TclError as e:
+
+            self.numThreads = max(1, int(self.paraCores.get()))
+        except (tk.TclError, ValueError) as e:
             print(e)
             return
 
@@ -441,7 +486,8 @@ class PrefForm():
                                         args=(self.filePaths, self.saveName,
                                               resample, resample_freq, lowpass, lowpass_freq,
                                               integrate, high1, high2,
-                                              trimStart, trimEnd, False, self.byteWidth, False))
+                                              trimStart, trimEnd, False, self.byteWidth, False),
+                                        kwargs={'numThreads': self.numThreads})
         self.thread1.start()
         self.button_confirm.config(state=tk.DISABLED)
 
@@ -1,6 +1,22 @@
 # Author Adrian Shedley
 # date 28 May 2020
 # purpose, contain and track the progress of each of the threads and tasks running
+# Also holds the shared thread pool that splits per-channel work (filtering, interpolation, integration) across cores
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+try:
+    import psutil  # Optional, for the memory available to new processes
+except ImportError:
+    psutil = None
+
+NUM_THREADS: int = os.cpu_count() or 4
+PROCESS_OVERHEAD_BYTES: int = 256 * 1024 * 1024  # Interpreter, numpy and scipy in each worker process
+MEMORY_FRACTION: float = 0.8  # Of the available memory that worker processes may use
+_POOL = None
 
 class Task():
     def __init__(self, name:str, taskID:int, type:str):
@@ -49,3 +65,71 @@ def update_ID(ID:int, prog):
     else:
         pass #print("didnt find")
 
+
+def set_threads(numThreads):
+    """ Sets the number of threads used for per-channel work, 1 runs everything in the calling thread"""
+    global NUM_THREADS, _POOL
+    numThreads = max(1, int(numThreads))
+    if numThreads != NUM_THREADS and _POOL is not None:
+        _POOL.shutdown(wait=True)
+        _POOL = None
+    NUM_THREADS = numThreads
+
+
+def _pool():
+    global _POOL
+    if _POOL is None:
+        _POOL = ThreadPoolExecutor(max_workers=NUM_THREADS, thread_name_prefix="channel")
+    return _POOL
+
+
+def per_channel(function, data, *args, **kwargs):
+    """ Returns function(data, *args, **kwargs) computed one channel (row) at a time across the thread pool.
+        function must take and return (channels, samples) arrays and treat each channel independently.
+        numpy and the scipy filters release the GIL while they work, so the channels really do run in parallel"""
+    if NUM_THREADS <= 1 or data.shape[0] <= 1:
+        return function(data, *args, **kwargs)
+
+    futures = [_pool().submit(function, data[i:i + 1], *args, **kwargs) for i in range(data.shape[0])]
+    out = None
+    for i, future in enumerate(futures):
+        result = future.result()
+        if out is None:
+            out = np.empty((data.shape[0], result.shape[1]), dtype=result.dtype)
+        out[i] = result[0]
+    return out
+
+
+def for_channels(function, numChannels, *args, **kwargs):
+    """ Calls function(i, *args, **kwargs) for each channel i across the thread pool and waits for them all. For work
+        that writes each channel into a preallocated array instead of returning it"""
+    if NUM_THREADS <= 1 or numChannels <= 1:
+        for i in range(numChannels):
+            function(i, *args, **kwargs)
+        return
+
+    futures = [_pool().submit(function, i, *args, **kwargs) for i in range(numChannels)]
+    for future in futures:
+        future.result()
+
+
+def available_memory():
+    """ Bytes of memory free for new work, or None if it cannot be found on this system"""
+    if psutil is not None:
+        return psutil.virtual_memory().available
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def process_limit(numProcesses, bytesPerProcess, numJobs):
+    """ The number of jobs to run at once in separate processes without the machine running out of memory and swapping"""
+    limit = max(1, min(numProcesses, numJobs))
+    available = available_memory()
+    if limit > 1 and available is not None:
+        fits = int(available * MEMORY_FRACTION // (bytesPerProcess + PROCESS_OVERHEAD_BYTES))
+        if fits < limit:
+            print("[WARN]: Only enough free memory to convert", max(fits, 1), "loggers at once")
+        limit = max(1, min(limit, fits))
+    return limit
@@ -8,6 +8,7 @@
 
 from struct import *
 import Multithread
+import rTime
 
 class DataSet:
     """ A dataset is for n channels from the same logger to be resampled all at once. """
@@ -80,35 +81,21 @@ def resample(targetStart, targetStop, targetFreq, dataSet: DataSet, resampleTask
     print(len(resampledLogger))
     return resampledLogger
 
-def get_range(min_max_start, min_max_stop, freq, trimStart, trimEnd):
-    """Returns the tuple of values
-            (resampleStart, resampleStop, numSamples)"""
-
-    marginSeconds = 0.25 # (1.0 / freq) * 0.1
-
+def get_grid(min_max_start, min_max_stop, freq, trimStart, trimEnd):
+    """Returns the rTime.Grid that every logger is resampled onto, from the latest start to the earliest stop of the
+        loggers less the trims, in exact nanoseconds"""
     # Calculate the trim on either end of the smallest range of samples for all loggers
-    realStart = min_max_start["max"] + max(trimStart, 0)
-    realStop = min_max_stop["min"] - marginSeconds - max(trimEnd, 0)
-
-    duration = realStop - realStart
-    if duration <= 0: print("Error: resample interval less than 0")
-
-    # Whole integer number of samples
-    numSamples = int(duration * freq) + 1
-
-    # New stop time, a whole number of samples after startTime
-    # Add half a wave so that the resample algo will get the same number of samples.
-    realStop = realStart + (1.0 / freq) * numSamples + (1.0/freq) * 0.50
-
-    return (realStart, realStop, numSamples)
-
-
-
-
-
-
-
+    realStart = rTime.to_ns(min_max_start["max"]) + rTime.to_ns(max(trimStart, 0))
+    realStop = rTime.to_ns(min_max_stop["min"]) - rTime.to_ns(max(trimEnd, 0))
 
+    if realStop <= realStart: print("Error: resample interval less than 0")
 
+    # Whole integer number of samples, the last one at or before realStop
+    return rTime.Grid.between(realStart, realStop, freq)
 
 
+def get_range(min_max_start, min_max_stop, freq, trimStart, trimEnd):
+    """Returns the tuple of values
+            (resampleStart, resampleStop, numSamples), resampleStop being the time of the last sample"""
+    grid = get_grid(min_max_start, min_max_stop, freq, trimStart, trimEnd)
+    return (grid.start, grid.stop, grid.numSamples)
@@ -104,11 +104,16 @@ Private Type DBSensorInfo
 End Type
 """
 
+import os
+import queue
+import threading
 from struct import *
 import cwa_metadata as CWA
+import rTime
 
 class Channel():
-    def __init__(self, logger, name, comment, deviceId, sessionId, numSamples, sampleRate, startTime, stopTime):
+    def __init__(self, logger, name, comment, deviceId, sessionId, numSamples, sampleRate, startTime, stopTime,
+                 grid=None):
         # Nice to have variables
         self.logger = logger
         # used variables
@@ -120,6 +125,7 @@ class Channel():
         self.startTime = startTime
         self.stopTime = stopTime
         self.sampleRate = sampleRate
+        self.grid = grid  # The exact rTime.Grid of a resampled channel, for its start time and dt
 
     def display(self):
         return "Name: " + self.name + ", (" + self.comment + ") with " + str(self.numSamples) + " samples at " + str(self.sampleRate) + "Hz"
@@ -191,6 +197,10 @@ def generate_BIN(testName, testComment, channelInfos, dataWidth, units='g'):
 
         # startTime in NOW format
         startTime = seconds_to_BIN_time(channel.startTime)
+        dt = 1000.0/float(chanRate)
+        if channel.grid is not None:
+            startTime = ns_to_BIN_time(channel.grid.startNs)
+            dt = channel.grid.dt_ms()
 
         ch += pack("H", i)    # Short     Channel location in catman database (0, 1, 2, ...)
         ch += pack("L", chanSamples)   # Int       Samples = Number of samples in this channel
@@ -213,7 +223,7 @@ def generate_BIN(testName, testComment, channelInfos, dataWidth, units='g'):
         ch += pack("L", 148)    # Int       Size of the extended channel header in bytes
         # 148 Bytes VB_DB_ChannelHeader -> special format discussed below with more channel information such as dt in ms and others, this is a contiguious block of data
         ch += pack('d', startTime) # T0 As Double                     'ACQ timestamp info (NOW format)
-        ch += pack('d', 1000.0/float(chanRate)) # dt As Double                      'ACQ delta t in ms
+        ch += pack('d', dt) # dt As Double                      'ACQ delta t in ms
         ch += pack("L", 0)  # SensorType As Integer        'IDS code of sensor type
         ch += pack("L", 0)  # SupplyVoltage As Integer    'IDS code supply voltage
         ch += pack("L", 0)  # FiltChar As Integer              'IDS code of filter characteristics
@@ -478,3 +488,126 @@ def seconds_to_BIN_time(seconds: float):
 
     return outputTime
 
+
+def ns_to_BIN_time(ns: int):
+    """As seconds_to_BIN_time for a time in whole nanoseconds since the UNIX epoch, the whole and fractional days are
+        found as integers so only the final fraction is rounded"""
+    (days, remainder) = divmod(ns, rTime.NS_PER_DAY)
+
+    unixEpochInOLE2 = 70 * 365 + 19
+
+    return float(days + unixEpochInOLE2) + remainder / rTime.NS_PER_DAY
+
+WRITE_BEHIND_DEPTH: int = 2  # Buffers a WriteBehind holds waiting for the disk, beyond the one being written
+
+
+def channel_bytes(numSamples, dataWidth):
+    """ Bytes one channel takes in the data block, 2 byte channels start with their float64 min and max"""
+    return numSamples * dataWidth + (16 if dataWidth == 2 else 0)
+
+
+def create_BIN(filePath, header, channelHeaders, channelInfos, dataWidth):
+    """ Writes the header and channel headers of a new BIN file and preallocates the whole data block after them, as
+        sized by the channels. Returns the file offset that the data block starts at"""
+    dataStart = len(header) + len(channelHeaders)
+    size = dataStart + sum([channel_bytes(channel.numSamples, dataWidth) for channel in channelInfos])
+
+    with open(filePath, "wb") as f:
+        f.write(header)
+        f.write(channelHeaders)
+        f.flush()
+        try:
+            os.posix_fallocate(f.fileno(), 0, size)  # Real blocks up front, so large outputs are not fragmented
+        except (AttributeError, OSError):
+            f.truncate(size)
+    return dataStart
+
+
+class BinWriter():
+    """ Writes into the data block of an existing BIN file at exact offsets, so that channels and blocks can be written
+        in any order and by several writers (threads or processes) at once.
+        Uses os.pwrite where the system has it (not Windows), otherwise a seek and write under a lock"""
+    def __init__(self, filePath):
+        self.filePath = filePath
+        self.fd = os.open(filePath, os.O_RDWR | getattr(os, 'O_BINARY', 0))
+        self.lock = threading.Lock()
+
+    def write(self, offset, data):
+        """ Writes a bytes-like object (bytes, or a contiguous numpy array) at offset bytes into the file"""
+        view = memoryview(data).cast('B')
+        while len(view) > 0:
+            if hasattr(os, 'pwrite'):
+                written = os.pwrite(self.fd, view, offset)
+            else:
+                with self.lock:
+                    os.lseek(self.fd, offset, os.SEEK_SET)
+                    written = os.write(self.fd, view)
+            # Very large writes can be split by the system
+            view = view[written:]
+            offset += written
+
+    def write_samples(self, channelOffset, start, data):
+        """ Writes the samples of one channel starting at sample index start, channelOffset being where the channel's
+            samples begin in the file"""
+        self.write(channelOffset + start * data.itemsize, data)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class WriteBehind():
+    """ A BinWriter that writes on its own thread, so the caller can go on to read and process the next data while the
+        last is still going to disk. Up to depth buffers wait in the queue, after which write blocks until the disk
+        catches up, keeping the memory held bounded. A buffer must not be changed after it is handed to write.
+        Errors on the writer thread are raised by the next write or by close"""
+    def __init__(self, filePath, depth=WRITE_BEHIND_DEPTH):
+        self.writer = BinWriter(filePath)
+        self.queue = queue.Queue(maxsize=max(1, depth))
+        self.error = None
+        self.thread = threading.Thread(target=self._run, name="WriteBehind", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            if self.error is None:  # After an error, drain the queue so the caller is never left blocked
+                try:
+                    self.writer.write(*item)
+                except BaseException as e:
+                    self.error = e
+
+    def _check(self):
+        if self.error is not None:
+            raise self.error
+
+    def write(self, offset, data):
+        self._check()
+        self.queue.put((offset, data))
+
+    def write_samples(self, channelOffset, start, data):
+        self.write(channelOffset + start * data.itemsize, data)
+
+    def close(self):
+        """ Waits for every queued write to reach the file"""
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+            self.writer.close()
+        self._check()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -31,11 +31,7 @@ def read_timestamp(data):
 
 # 16-bit checksum (should sum to zero)
 def checksum(data):
-    sum = 0
-    for i in range(0, len(data), 2):
-        value = data[i] | (data[i + 1] << 8)
-        sum = (sum + value) & 0xffff
-    return sum
+    return sum(unpack('<%dH' % (len(data) // 2), data[:len(data) & ~1])) & 0xffff
 
 
 def short_sign_extend(value):
@@ -433,6 +429,64 @@ def cwa_info(filename, extract=False):
     return info
 
 
+class LoggerInfo:
+    """ Compact metadata record of one .cwa file, everything needed to plan a conversion without any sample data.
+        The decoded first and last sectors, with their samples, are only read from the file when first accessed"""
+    FIELDS = ('filePath', 'name', 'size', 'headerSize', 'numSectors', 'samplesPerSector', 'numSamples', 'duration',
+              'meanRate', 'deviceId', 'sessionId', 'sampleRate', 'accelRange', 'channels', 'bytesPerAxis',
+              'accelUnit', 'accelScale', 'gyroScale', 'magScale', 'startTime', 'stopTime', 'metadata')
+    __slots__ = FIELDS + ('_first', '_last')
+
+    def __init__(self, **values):
+        for name in self.FIELDS:
+            setattr(self, name, values.get(name))
+        self._first = None
+        self._last = None
+
+    @classmethod
+    def from_info(cls, filePath, info):
+        """ Builds the record from a cwa_info dictionary"""
+        file, header, first, last = info['file'], info['header'], info['first'], info['last']
+        sector = first if 'channels' in first else last
+        return cls(filePath=filePath, name=file['name'], size=file['size'], headerSize=file['headerSize'],
+                   numSectors=file['numSectors'], samplesPerSector=file['samplesPerSector'],
+                   numSamples=file['numSamples'], duration=file['duration'], meanRate=file['meanRate'],
+                   deviceId=header.get('deviceId', 0), sessionId=header.get('sessionId', 0),
+                   sampleRate=header.get('sampleRate', 0), accelRange=header.get('accelRange', 0),
+                   channels=sector.get('channels', 0), bytesPerAxis=sector.get('bytesPerAxis', 2),
+                   accelUnit=sector.get('accelUnit', 256), accelScale=sector.get('accelScale', 256),
+                   gyroScale=sector.get('gyroScale'), magScale=sector.get('magScale'),
+                   startTime=first.get('timestamp', 0), stopTime=last.get('timestamp', 0),
+                   metadata=header.get('metadata', {}))
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+    def _read_sector(self, offset):
+        with open(self.filePath, "rb") as f:
+            f.seek(offset)
+            return cwa_data(f.read(512), extractData=True)
+
+    @property
+    def first(self):
+        """ The first data sector decoded by cwa_data, including its samples"""
+        if self._first is None:
+            self._first = self._read_sector(self.headerSize)
+        return self._first
+
+    @property
+    def last(self):
+        """ The last data sector decoded by cwa_data, including its samples"""
+        if self._last is None:
+            self._last = self._read_sector(self.size - 512)
+        return self._last
+
+
+def cwa_record(filename):
+    """ Metadata only version of cwa_info, returned as a LoggerInfo record. No samples are decoded"""
+    return LoggerInfo.from_info(filename, cwa_info(filename, extract=False))
+
+
 # Test function
 if __name__ == "__main__":
     import json
@@ -2,15 +2,21 @@
 # Date 14 July 2020
 # This file will create and apply the filtering as required in a FIR format from scipy.
 
+from functools import lru_cache, partial
+
 import numpy as np
 
 # import scipy as sp
 from scipy.signal import butter
-from scipy.signal import filtfilt, sosfiltfilt
+from scipy.signal import sosfiltfilt, sosfilt, sosfilt_zi, sosfreqz
+
+import Multithread
+
+FILTER_CACHE_SIZE: int = 64  # Distinct filter designs and responses kept per process
 
 
 def _butter_lowpass(order, cutoff_freq):
-    return butter(order, Wn=cutoff_freq, btype='lowpass', analog=False, output='ba')
+    return butter(order, Wn=cutoff_freq, btype='lowpass', analog=False, output='sos')
 
 def _butter_highpass(order, cutoff_freq):
     return butter(order, Wn=cutoff_freq, btype='highpass', analog=False, output='sos')
@@ -18,23 +24,140 @@ def _butter_highpass(order, cutoff_freq):
 #def _cheby2_highpass(order, cutoff_freq):
 #    return cheby2(order, 40.0, Wn=cutoff_freq, btype='highpass', analog=False, output='sos')
 
-def lowpass_filter(data, order=8, in_freq=800.0, cutoff_freq=100.0):
+def transient_seconds(order=8, cutoff_freq=1.0):
+    """ A conservative estimate of how long the start-up transient of a Butterworth filter lasts, in seconds"""
+    return float(order) / cutoff_freq
 
+
+def _lowpass_wn(in_freq, cutoff_freq):
     offset_freq = (0.1 * cutoff_freq) / 2.0
 
     # Modify the cutoff such that the frequency content is mostly gone by the desired freq
     cutoff_freq -= offset_freq
-    lowp_freq = (cutoff_freq / (in_freq/2)) * 0.98
-    b = _butter_lowpass(order, lowp_freq)
+    return (cutoff_freq / (in_freq/2)) * 0.98
+
+
+@lru_cache(maxsize=FILTER_CACHE_SIZE)
+def design(btype, order, cutoff_freq, in_freq):
+    """ The 'lowpass' or 'highpass' Butterworth filter in second order sections, which stay stable at low cutoffs.
+        Each (type, order, cutoff, sample rate) is designed once per process and shared, so it must not be modified"""
+    if btype == 'lowpass':
+        sos = _butter_lowpass(order, _lowpass_wn(in_freq, cutoff_freq))
+    else:
+        sos = _butter_highpass(order, (cutoff_freq / (in_freq/2)))
+    return sos
+
+
+@lru_cache(maxsize=FILTER_CACHE_SIZE)
+def response(btype, order, cutoff_freq, in_freq, numPoints=1024):
+    """ Returns (freqs, gain), the frequency response of a design in Hz and dB, for display"""
+    (freqs, h) = sosfreqz(design(btype, order, cutoff_freq, in_freq), worN=numPoints, fs=in_freq)
+    gain = 20 * np.log10(np.maximum(np.abs(h), 1e-12))
+    freqs.flags.writeable = False
+    gain.flags.writeable = False
+    return (freqs, gain)
+
+
+def gain_at(freq, btype, order, cutoff_freq, in_freq):
+    """ The gain in dB of a design at freq Hz, from its cached response"""
+    (freqs, gain) = response(btype, order, cutoff_freq, in_freq)
+    return float(np.interp(freq, freqs, gain))
+
+
+def lowpass_filter(data, order=8, in_freq=800.0, cutoff_freq=100.0):
+    sos = design('lowpass', order, cutoff_freq, in_freq)
 
-    # Perform the filtering using Scipy, expensive operation
-    return filtfilt(b[0], b[1], data)
+    # Perform the filtering using Scipy, expensive operation. Each channel on its own thread
+    return Multithread.per_channel(partial(sosfiltfilt, sos), data)
 
 
 def highpass_filter(data, order=8, in_freq=800.0, cutoff_freq=1.0):
-    highp_freq = (cutoff_freq / (in_freq/2))
-    sos = _butter_highpass(order, highp_freq) # _butter_highpass(order, highp_freq)
+    sos = design('highpass', order, cutoff_freq, in_freq)
+
+    # Perform the filtering using Scipy, expensive operation. Each channel on its own thread
+    return Multithread.per_channel(partial(sosfiltfilt, sos), data)
+
+
+class SosFilter:
+    """ Causal filtering of a stream of blocks with sosfilt, see rStream. The filter state zi is carried from one block
+        to the next so the result is the same as filtering the whole signal at once. It starts at the steady state of
+        the first sample"""
+
+    def __init__(self, sos):
+        self.sos = sos
+        self.zi = None
+
+    def filter(self, block):
+        if self.zi is None:
+            self.zi = sosfilt_zi(self.sos)[:, None, :] * block[None, :, 0, None]
+        (filtered, self.zi) = sosfilt(self.sos, block, axis=-1, zi=self.zi)
+        return filtered
+
+    def push(self, start, block):
+        return [(start, self.filter(block))]
+
+    def flush(self):
+        return []
+
+
+class ZeroPhaseFilter:
+    """ sosfiltfilt over a stream of blocks in constant memory, see rStream.
+        The forward pass is one SosFilter over the whole stream, padded at each end the same way as sosfiltfilt.
+        The backward pass over each piece starts lookahead samples after its end from the steady state there, and has
+        settled to the whole-signal result by the time it reaches the piece. Only the last piece is exact, the others
+        are within the filter's decay over lookahead samples"""
+
+    def __init__(self, sos, lookahead):
+        self.sos = sos
+        self.lookahead = lookahead
+        ntaps = 2 * sos.shape[0] + 1 - min((sos[:, 2] == 0).sum(), (sos[:, 5] == 0).sum())
+        self.edge = 3 * ntaps  # The default sosfiltfilt padding
+        self.forward = SosFilter(sos)
+        self.pending = None  # Input held until there is enough for the start padding
+        self.tail = None  # The last input samples, for the end padding
+        self.buffer = None  # Forward filtered samples not passed on yet
+        self.next = 0
+
+    def push(self, start, block):
+        if self.buffer is None:
+            if self.pending is None:
+                (self.pending, self.next) = (block, start)
+            else:
+                self.pending = np.concatenate((self.pending, block), axis=1)
+            if self.pending.shape[1] <= self.edge:
+                return []
+            (block, self.pending) = (self.pending, None)
+            # Odd extension before the first sample, run only to set the filter state
+            self.forward.filter(2 * block[:, :1] - block[:, self.edge:0:-1])
+            self.buffer = np.zeros((block.shape[0], 0))
+            self.tail = block[:, :0]
+
+        self.tail = np.concatenate((self.tail, block), axis=1)[:, -(self.edge + 1):]
+        self.buffer = np.concatenate((self.buffer, self.forward.filter(block)), axis=1)
+
+        # Wait for at least lookahead new samples so the backward pass covers each sample no more than twice
+        ready = self.buffer.shape[1] - self.lookahead
+        if ready < max(self.lookahead, 1):
+            return []
+        return [self._backward(ready)]
+
+    def flush(self):
+        if self.buffer is None:
+            if self.pending is not None:
+                raise ValueError("The stream is too short to filter, it needs more than " + str(self.edge) + " samples")
+            return []
+        # Odd extension after the last sample, then the backward pass from the very end as sosfiltfilt does
+        padding = 2 * self.tail[:, -1:] - self.tail[:, -2:-(self.edge + 2):-1]
+        self.buffer = np.concatenate((self.buffer, self.forward.filter(padding)), axis=1)
+        return [self._backward(self.buffer.shape[1] - self.edge)]
 
-    # Perform the filtering using Scipy, expensive operation
-    return sosfiltfilt(sos, data)
+    def _backward(self, ready):
+        """ Runs the backward pass from the end of the buffer and passes on its first ready samples"""
+        reverse = self.buffer[:, ::-1]
+        zi = sosfilt_zi(self.sos)[:, None, :] * reverse[None, :, 0, None]
+        (filtered, _) = sosfilt(self.sos, reverse, axis=-1, zi=zi)
 
+        piece = (self.next, filtered[:, ::-1][:, :ready])
+        self.buffer = self.buffer[:, ready:]
+        self.next += ready
+        return piece
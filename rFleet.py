@@ -0,0 +1,56 @@
+# Date 18 October 2026
+# Purpose: Scan a whole set of .cwa logger files at once. The headers and first/last sectors of every file are read
+#   concurrently (the work is waiting on disk or network, not on Python), and the results are returned as one table
+#   with a row per logger so that checks across the fleet can be done in single numpy operations.
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import rIndex
+
+SCAN_THREADS: int = 16
+
+# Columns of the fleet table, one row per logger
+FLEET_COLUMNS = [('deviceId', '<i8'), ('sessionId', '<i8'), ('rate', '<f8'), ('channels', '<i8'),
+                 ('startTime', '<f8'), ('stopTime', '<f8'), ('numSamples', '<i8')]
+
+
+def scan_fleet(listLoggerFiles, numThreads=SCAN_THREADS):
+    """ Reads the metadata of every logger file concurrently.
+        Returns (table, loggers), a structured array with a filePath column plus FLEET_COLUMNS and the list of
+        cwa_metadata.LoggerInfo records, both in the order of listLoggerFiles"""
+    with ThreadPoolExecutor(max_workers=max(1, min(numThreads, len(listLoggerFiles)))) as pool:
+        loggers = list(pool.map(rIndex.logger_info, listLoggerFiles))
+
+    pathLength = max([len(path) for path in listLoggerFiles] + [1])
+    table = np.zeros((len(loggers), ), dtype=[('filePath', 'U' + str(pathLength))] + FLEET_COLUMNS)
+
+    table['filePath'] = listLoggerFiles
+    for (name, _) in FLEET_COLUMNS:
+        attribute = {'rate': 'meanRate'}.get(name, name)
+        table[name] = [getattr(logger, attribute) for logger in loggers]
+
+    return (table, loggers)
+
+
+def summary(table, column):
+    """ Returns the max, min and average of one column of the fleet table, and which logger holds the max and min.
+        {"max", "maxLogger", "min", "minLogger", "average", "numLoggers"}"""
+    if table.shape[0] == 0:
+        return {"max": 0, "maxLogger": "", "min": 1e100, "minLogger": "", "average": 0.0, "numLoggers": 0}
+
+    values = table[column]
+    maxIndex = int(np.argmax(values))
+    minIndex = int(np.argmin(values))
+    return {"max": values[maxIndex].item(), "maxLogger": str(table['filePath'][maxIndex]),
+            "min": values[minIndex].item(), "minLogger": str(table['filePath'][minIndex]),
+            "average": float(np.mean(values)), "numLoggers": table.shape[0]}
+
+
+def outliers(table, column, absDiffLimit):
+    """ Returns a boolean mask of the loggers whose value in column is more than absDiffLimit away from the fleet average"""
+    values = table[column].astype(np.float64)
+    if values.shape[0] == 0:
+        return np.zeros((0, ), dtype=bool)
+    return np.abs(values - values.mean()) > absDiffLimit
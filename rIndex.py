@@ -0,0 +1,129 @@
+# Date 18 October 2026
+# Purpose: Keep a small index file next to each .cwa file so that it only has to be scanned once.
+#   The index holds the header metadata (cwa_metadata.LoggerInfo) and, once a full read has happened, the compact header fields and
+#   validity of every sector. It is keyed by the file size, modification time and a hash of the file header, so an
+#   index for a file that has since changed is ignored and rebuilt.
+
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+import cwa_metadata as CWA
+import rapidCWA as rCWA
+
+INDEX_VERSION: int = 2
+INDEX_EXTENSION: str = ".idx"
+CACHE_DIR: str = os.path.join(tempfile.gettempdir(), "cwa_index")  # Used when the .cwa folder is read only
+
+# The metadata of the indexes already loaded by this process, by file path. The sector arrays are never kept here, they
+#   are read for each sector_index call and released by the caller once the logger is converted
+_LOADED = {}
+
+
+def _file_key(filePath):
+    """ The (size, mtime, header hash) of a file that an index must match to be used"""
+    stat = os.stat(filePath)
+    with open(filePath, "rb") as f:
+        headerHash = hashlib.sha1(f.read(1024)).hexdigest()
+    return (stat.st_size, stat.st_mtime, headerHash)
+
+
+def _index_paths(filePath):
+    """ The sidecar path next to the file, then the fallback path in the cache folder"""
+    sidecar = filePath + INDEX_EXTENSION
+    cacheName = hashlib.sha1(os.path.abspath(filePath).encode('utf8')).hexdigest() + INDEX_EXTENSION
+    return [sidecar, os.path.join(CACHE_DIR, cacheName)]
+
+
+def _read_index(filePath, key, arrays=False):
+    """ Returns the stored index of a file as a dictionary, or None if there is none matching key.
+        arrays = also decompress the sector 'headers' and 'valid', otherwise 'indexed' only says whether they are stored"""
+    for path in _index_paths(filePath):
+        if not os.path.isfile(path):
+            continue
+        try:
+            with np.load(path, allow_pickle=False) as stored:
+                if int(stored['version']) != INDEX_VERSION or \
+                        (int(stored['size']), float(stored['mtime']), str(stored['headerHash'])) != key:
+                    continue
+                index = {'info': CWA.LoggerInfo(**json.loads(str(stored['info'])))}
+                index['info'].filePath = filePath  # The file may have been indexed through a different path
+                index['indexed'] = 'headers' in stored
+                if arrays and index['indexed']:
+                    index['headers'] = stored['headers']
+                    index['valid'] = stored['valid']
+                return index
+        except (OSError, ValueError, KeyError) as e:
+            print("[WARN]: Ignoring unreadable index", path, e)
+    return None
+
+
+def _write_index(filePath, key, index):
+    """ Saves the index next to the file, or in the cache folder if that is not possible"""
+    arrays = {'version': INDEX_VERSION, 'size': key[0], 'mtime': key[1], 'headerHash': key[2],
+              'info': json.dumps(index['info'].to_dict())}
+    if 'headers' in index:
+        arrays['headers'] = index['headers']
+        arrays['valid'] = index['valid']
+
+    for path in _index_paths(filePath):
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            with open(path + ".tmp", "wb") as f:
+                np.savez_compressed(f, **arrays)
+            os.replace(path + ".tmp", path)
+            return path
+        except OSError:
+            continue
+    print("[WARN]: Could not save an index for", filePath)
+    return None
+
+
+def _load(filePath):
+    """ Returns (key, {'info', 'indexed'}), the metadata of the index of a file from this process, from disk, or freshly
+        built from the header"""
+    key = _file_key(filePath)
+    cached = _LOADED.get(filePath)
+    if cached is not None and cached[0] == key:
+        return (key, cached[1])
+
+    index = _read_index(filePath, key)
+    if index is None:
+        index = {'info': CWA.cwa_record(filePath), 'indexed': False}
+        _write_index(filePath, key, index)
+
+    _LOADED[filePath] = (key, index)
+    return (key, index)
+
+
+def logger_info(filePath):
+    """ Returns the LoggerInfo metadata record of a file, without reading it again if it has been indexed"""
+    (_, index) = _load(filePath)
+    return index['info']
+
+
+def sector_index(filePath, build=True):
+    """ Returns the {'headers', 'valid'} sector index of a file for the rapidCWA readers.
+        If the file has not been fully indexed yet it is scanned once and saved when build is True, otherwise None.
+        The arrays are not cached, drop the index once the file has been read"""
+    (key, cached) = _load(filePath)
+    if cached['indexed']:
+        index = _read_index(filePath, key, arrays=True)
+        if index is not None and index['indexed']:
+            return index
+    if not build:
+        return None
+
+    print("Indexing", filePath)
+    index = {'info': cached['info'], 'indexed': True}
+    sectors = rCWA.read_sectors(filePath, index['info'].headerSize)
+    index['headers'] = rCWA.sector_headers(sectors)
+    index['valid'] = rCWA.valid_sectors(sectors)
+    del sectors
+
+    _write_index(filePath, key, index)
+    cached['indexed'] = True
+    return index
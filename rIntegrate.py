@@ -4,8 +4,15 @@
 
 import numpy as np
 
+import Multithread
+
 
 def integrate_data(data, frequency=800.0, out_units='mm/s'):
+    # Each channel is integrated on its own thread
+    return Multithread.per_channel(_integrate, data, frequency, out_units)
+
+
+def _integrate(data, frequency=800.0, out_units='mm/s'):
     dx = 1/frequency
 
     # Create a array to hold the running_sum
@@ -25,3 +32,44 @@ def integrate_data(data, frequency=800.0, out_units='mm/s'):
     # Summation of the trapezoids to perform a pseudo integral. Axis=1 to go along each channel individually
     running_sum = np.cumsum(running_sum, axis=1)
     return running_sum
+
+
+class Integrator:
+    """ integrate_data for a stream of (start, block) pieces of one signal, see rStream.
+        The last input sample and the running sum are carried from one block to the next, so the output is identical to
+        integrating the whole signal at once. Output lags the input by one sample, the last one comes from flush()"""
+
+    def __init__(self, frequency=800.0):
+        dx = 1/frequency
+        self.scale = (9.81*1000 * dx) / 2.0  # As integrate_data
+        self.last = None  # The last input sample of the previous block
+        self.total = None  # The running sum up to the last output sample
+        self.next = 0  # Index of the next output sample
+
+    def push(self, start, block):
+        if self.last is None:
+            self.next = start
+            self.total = np.zeros((block.shape[0], 1), dtype='float64')
+        else:
+            block = np.concatenate((self.last, block), axis=1)
+        self.last = block[:, -1:].copy()
+        if block.shape[1] < 2:
+            return []
+
+        # The running total goes in front so that the cumulative sum adds in exactly the same order as integrate_data
+        running_sum = np.empty(block.shape, dtype='float64')
+        running_sum[:, :1] = self.total
+        running_sum[:, 1:] = self.scale * (block[:, :-1] + block[:, 1:])
+        running_sum = np.cumsum(running_sum, axis=1)[:, 1:]
+
+        self.total = running_sum[:, -1:]
+        start = self.next
+        self.next += running_sum.shape[1]
+        return [(start, running_sum)]
+
+    def flush(self):
+        if self.last is None:
+            return []
+        # integrate_data leaves the last trapezoid empty, so the final sample repeats the running total
+        self.next += 1
+        return [(self.next - 1, self.total + 0.0)]
@@ -3,24 +3,23 @@
 # Code modified from the scipy standard library's interp1d method in order to cut down on memory usage
 #   This library would use 4-6x as much memory as the arrays that it was using
 # Last modified 6 July 2020
+# Interpolates a chunk of the output at a time into a preallocated array, so the peak memory is the input plus the output
 
 import numpy as np
 import ProgressPrinter as pbar
+import Multithread
+import rTime
 
-def interp1d(y, startVal, endVal, startInterp, endInterp, equispacing, kind='linear', fill_value=0):
+INTERP_CHUNK: int = 1 << 18  # Output samples interpolated at a time
 
-        if y.ndim == 0:
-            raise ValueError("the y array must have at least one dimension.")
 
-        endInterp = endInterp if endInterp <= endVal else endVal
-        startInterp = startInterp if startInterp >= startVal else startVal
+def interp1d(y, startVal, endVal, startInterp, endInterp, equispacing, kind='linear', fill_value=0,
+             outputSamples=None):
+        """ outputSamples = the exact number of output samples, from startInterp equispacing apart, for an output that
+            must match a grid (see rTime.Grid). Default as many as fit between startInterp and endInterp"""
 
-        startVal = startVal
-        endVal = endVal
-
-        # The difference between samples on the input and output sequences
-        inputDelta = (endVal-startVal) / y.shape[1]
-        outputSamples = int((endInterp-startInterp)/equispacing) + 1
+        if y.ndim == 0:
+            raise ValueError("the y array must have at least one dimension.")
 
         if kind != 'linear':
             raise ValueError("The interpolation type must be linear")
@@ -41,12 +40,92 @@ def interp1d(y, startVal, endVal, startInterp, endInterp, equispacing, kind='lin
 
         # Let N be number of samples and H be number of channels
 
-        # Get a linear spacing array of the actual time in seconds for all output points required [start:end:delta]
-        #   Shape = (N)
-        outSeq = np.linspace(startInterp - startVal, endInterp - startVal, outputSamples) / inputDelta
-        outSeq[outSeq >= y.shape[1]] = y.shape[1] - 2
+        # The fractional input sample index of every output sample, found a chunk at a time
+        (positions, outputSamples) = linear_positions(startVal, endVal, y.shape[1], startInterp, endInterp,
+                                                      equispacing, outputSamples)
         print("Linear Resample output defined.")
-        # pbar.printProgressBar(10, 100, prefix="Resample", printEnd=" ")
+
+        return interpolate(y, positions, outputSamples)
+
+
+def interp_anchored(y, anchorIndex, anchorTime, grid, inputPeriod):
+    """ Resamples y onto the samples of grid (an rTime.Grid), against the time of every input sample reconstructed from
+        the sector anchors (see rapidCWA.sector_anchors) rather than one mean rate. Drift and rate changes within the
+        file then do not become timing errors in the output.
+        inputPeriod = the seconds between input samples, used only when there are too few anchors to measure it"""
+    print("Timed Resample Start.")
+    positions = anchored_positions(anchorIndex, anchorTime, grid, inputPeriod)
+    return interpolate(y, positions, grid.numSamples)
+
+
+def interpolate(y, positions, outputSamples):
+    """ Linear interpolation of each channel (row) of y at the fractional input sample indices positions(k) of the
+        output samples k = 0 to outputSamples - 1"""
+    print(" ... Resampling in progress. This may take 5 to 60 seconds ...\r")
+    V = np.empty((y.shape[0], outputSamples), dtype=np.float64)
+    interpolate_into(y, positions, V)
+    print("Linear Resample Complete.")
+
+    return V
+
+
+def interpolate_into(y, positions, V):
+    """ As interpolate, into the preallocated (channels, outputSamples) array V"""
+    outputSamples = V.shape[1]
+    scratch = _Scratch(positions, y.shape[1], y.shape[0])
+
+    # Interpolation calculation, a chunk of the output at a time into the preallocated output array, each channel
+    #   on its own thread
+    for first in range(0, outputSamples, INTERP_CHUNK):
+        count = min(INTERP_CHUNK, outputSamples - first)
+        (lo, hi, B) = scratch.weights(first, count)
+        Multithread.for_channels(_lerp, y.shape[0], y, lo, hi, B, V[:, first:first + count], scratch.rows)
+
+
+def _lerp(i, y, lo, hi, B, out, rows):
+    """ out[i] = B * (y[i, hi] - y[i, lo]) + y[i, lo], using rows[i] as the only scratch"""
+    count = out.shape[1]
+    a = out[i]
+    b = rows[i, :count]
+    row = y[i]
+    if row.flags.contiguous:
+        np.take(row, lo, out=a, mode='clip')
+        np.take(row, hi, out=b, mode='clip')
+    else:
+        # np.take copies the whole of a strided row (such as the reversed view from sosfiltfilt) for every chunk, an
+        #   index gathers straight from the strides into a temporary of one chunk
+        a[:] = row[lo]
+        b[:] = row[hi]
+    b -= a
+    b *= B
+    b += a
+    a[:] = b
+
+
+class _Scratch:
+    """ The working arrays of interp1d, allocated once for a chunk of INTERP_CHUNK output samples and reused for every
+        chunk, so the peak memory is the input and output arrays plus this fixed amount"""
+
+    def __init__(self, positions, numInputs, numChannels):
+        self.positions = positions
+        self.numInputs = numInputs
+        self.base = np.arange(INTERP_CHUNK, dtype=np.int64)
+        self.k = np.empty(INTERP_CHUNK, dtype=np.int64)
+        self.pos = np.empty(INTERP_CHUNK)
+        self.mask = np.empty(INTERP_CHUNK, dtype=bool)
+        self.lo = np.empty(INTERP_CHUNK, dtype=np.int64)
+        self.hi = np.empty(INTERP_CHUNK, dtype=np.int64)
+        self.B = np.empty(INTERP_CHUNK)
+        self.rows = np.empty((numChannels, INTERP_CHUNK))
+
+    def weights(self, first, count):
+        """ Returns (lo, hi, B) for output samples first to first+count, the input samples either side of each and
+            the fraction of the way from lo to hi"""
+        k = np.add(self.base[:count], first, out=self.k[:count])
+        pos = self.positions(k, out=self.pos[:count])
+        mask = np.greater_equal(pos, self.numInputs, out=self.mask[:count])
+        np.putmask(pos, mask, self.numInputs - 2)
+        np.maximum(pos, 0, out=pos)  # Output before the first input sample holds it
 
         # Get the whole integer index of the input sample for this linear interpolation
         #
@@ -54,28 +133,67 @@ def interp1d(y, startVal, endVal, startInterp, endInterp, equispacing, kind='lin
         #         *C
         #               * B
         # We have points A and B from the input set, and require C.
-        #   Shape = (N) as type INTEGER
-        lo = outSeq.astype(np.int32)
-        # Ensure that all values of the original input indexs are inbound.. this is a Hack and should be cleaned later
+        lo = self.lo[:count]
+        np.copyto(lo, pos, casting='unsafe')
+        hi = np.add(lo, 1, out=self.hi[:count])
 
         # The B array is an array that is the difference between the point C and the point A in the time domain
         # It is the scale factor distance of C between A and B for all points in the new output
-        #   Shape = (N)
-        B = np.subtract(outSeq, lo)
-        del outSeq
-
-        print(" ... Resampling in progress. This may take 5 to 60 seconds ...\r")
-        #pbar.printProgressBar(15, 100, prefix="Resample", printEnd=" ")
-
-        # Interpolation calculation
-        V = B * (y[:,(lo + 1)] - y[:,lo]) + y[:,lo]
-
-        #pbar.printProgressBar(95, 100, prefix="Resample", printEnd=" ")
+        B = np.subtract(pos, lo, out=self.B[:count])
+        return (lo, hi, B)
 
-        del lo
-        del B
 
-        #pbar.printProgressBar(100, 100, prefix="Resample", printEnd=" ")
-        print("Linear Resample Complete.")
-
-        return V
\ No newline at end of file
+def linear_positions(startVal, endVal, numInputs, startInterp, endInterp, equispacing, outputSamples=None):
+    """ The output to input mapping of interp1d as a function, for interpolating a stream of blocks.
+        Returns (positions, outputSamples), where positions(k) gives the fractional input sample index of the output
+        samples k, exactly as interp1d computes them"""
+    if outputSamples is None:
+        endInterp = endInterp if endInterp <= endVal else endVal
+        startInterp = startInterp if startInterp >= startVal else startVal
+        outputSamples = int((endInterp - startInterp) / equispacing) + 1
+    else:
+        # A given number of samples lands exactly on the grid, any before or after the input hold its first or last
+        endInterp = startInterp + (outputSamples - 1) * equispacing
+
+    inputDelta = (endVal - startVal) / numInputs
+
+    # np.linspace(first, last, outputSamples), one piece at a time
+    first = startInterp - startVal
+    last = endInterp - startVal
+    step = (last - first) / (outputSamples - 1) if outputSamples > 1 else 0.0
+
+    def positions(k, out=None):
+        outSeq = np.multiply(k, step, out=out)
+        outSeq += first
+        outSeq[k == outputSamples - 1] = last
+        outSeq /= inputDelta
+        return outSeq
+
+    return (positions, outputSamples)
+
+
+def anchored_positions(anchorIndex, anchorTime, grid, inputPeriod):
+    """ The output to input mapping of interp_anchored as a function, positions(k) gives the fractional input sample
+        index of the output samples k of grid (an rTime.Grid). The time of each input sample is linear between sector
+        anchors and at the mean rate of the file beyond the first and last, as rapidCWA.sample_times"""
+    # Times relative to the first anchor, which keeps the full precision of the fractions of a second
+    originNs = rTime.to_ns(anchorTime[0])
+    times = anchorTime - rTime.to_seconds(originNs)
+    period = inputPeriod
+    if anchorIndex.shape[0] >= 2:
+        period = (times[-1] - times[0]) / (anchorIndex[-1] - anchorIndex[0])
+
+    def positions(k, out=None):
+        t = grid.offset_seconds(k, originNs, out=out)
+        # Between anchors, the inverse of the piecewise linear time axis
+        outSeq = np.interp(t, times, anchorIndex)
+        before = t < times[0]
+        outSeq[before] = anchorIndex[0] + (t[before] - times[0]) / period
+        after = t > times[-1]
+        outSeq[after] = anchorIndex[-1] + (t[after] - times[-1]) / period
+        if out is None:
+            return outSeq
+        out[:] = outSeq
+        return out
+
+    return positions
@@ -0,0 +1,121 @@
+# Date 18 October 2026
+# Purpose: Read-ahead of the logger files that are converted next. While one logger is processed, a background thread
+#   reads the next one or two .cwa files so their bytes are in the operating system's page cache by the time
+#   rapidCWA maps them. This hides the latency of files on network shares behind the processing of the current logger.
+#   Only the byte range of each file that the conversion reads is read ahead, which for a resampled window of a long
+#   recording is the sectors of that window, not the start of the file.
+#   The bytes read ahead of the current logger are capped, so a long list of large files does not push everything else
+#   out of the cache. Nothing is held in this process beyond one chunk buffer.
+
+import os
+import threading
+
+PREFETCH_FILES: int = 2  # Files read ahead of the one being converted
+PREFETCH_MEMORY: int = 1024 * 1024 * 1024  # Bytes read ahead of the one being converted
+CHUNK_BYTES: int = 4 * 1024 * 1024  # Size of each read
+
+
+class Prefetcher():
+    """ Reads ahead through filePaths, in order, on a background thread. Call advance(i) as file i starts being
+        converted, which lets the thread read files i+1 up to i+ahead, up to maxBytes of them. close() stops it.
+        locate = a function of i giving the (start, stop) byte range of file i that will be read, called on the
+        background thread just before the file is read ahead, default the whole file.
+        Prefetching is only a hint, a file that cannot be read is left for the converter to report"""
+
+    def __init__(self, filePaths, maxBytes=PREFETCH_MEMORY, ahead=PREFETCH_FILES, locate=None):
+        self.filePaths = list(filePaths)
+        self.maxBytes = maxBytes
+        self.ahead = ahead
+        self.locate = locate
+        self.ranges = {}  # The (start, stop) byte range of each file read ahead
+        self.current = -1
+        self.done = 0  # Files fully read ahead so far, from the start of the list
+        self.stop = False
+        self.wake = threading.Condition()
+        self.thread = threading.Thread(target=self._run, name="Prefetcher", daemon=True)
+        self.thread.start()
+
+    def advance(self, index):
+        """ File index is now being converted, so the files after it may be read"""
+        with self.wake:
+            self.current = index
+            self.wake.notify()
+
+    def _next(self):
+        """ Waits for a file that may be read now, returns its index or None to stop"""
+        with self.wake:
+            while not self.stop:
+                nextFile = max(self.done, self.current + 1)
+                if self.current >= 0 and nextFile < len(self.filePaths) and nextFile <= self.current + self.ahead:
+                    return nextFile
+                if nextFile >= len(self.filePaths):
+                    return None
+                self.wake.wait()
+            return None
+
+    def _run(self):
+        while True:
+            index = self._next()
+            if index is None:
+                return
+            self.ranges[index] = self._range(index)
+            budget = self.maxBytes - self._ahead_bytes(index)
+            self._read(self.filePaths[index], self.ranges[index], budget)
+            with self.wake:
+                self.done = index + 1
+
+    def _range(self, index):
+        """ The (start, stop) byte range of file index to read ahead"""
+        if self.locate is not None:
+            try:
+                return self.locate(index)
+            except (OSError, ValueError):
+                pass
+        return (0, _file_size(self.filePaths[index]))
+
+    def _ahead_bytes(self, index):
+        """ Bytes already read ahead between the file being converted and file index"""
+        return sum([stop - start for (i, (start, stop)) in self.ranges.items() if self.current < i < index])
+
+    def _read(self, filePath, byteRange, budget):
+        """ Pulls up to budget bytes from the start of the (start, stop) byteRange of filePath into the page cache"""
+        if budget <= 0:
+            return
+        try:
+            with open(filePath, 'rb', buffering=0) as fp:
+                (start, stop) = byteRange
+                length = min(stop - start, budget)
+                if length <= 0:
+                    return
+                if hasattr(os, 'posix_fadvise'):
+                    # Lets the system start the whole read at once, the reads below then make sure it happened
+                    os.posix_fadvise(fp.fileno(), start, length, os.POSIX_FADV_WILLNEED)
+                fp.seek(start)
+                buffer = memoryview(bytearray(CHUNK_BYTES))
+                pos = 0
+                while pos < length and not self.stop:
+                    read = fp.readinto(buffer[:min(CHUNK_BYTES, length - pos)])
+                    if not read:
+                        break
+                    pos += read
+        except OSError:
+            pass
+
+    def close(self):
+        with self.wake:
+            self.stop = True
+            self.wake.notify()
+        self.thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _file_size(filePath):
+    try:
+        return os.path.getsize(filePath)
+    except OSError:
+        return 0
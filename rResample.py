@@ -0,0 +1,279 @@
+# Date 18 October 2026
+# Purpose: Polyphase resampling of a logger onto a resample grid, an alternative to the lowpass filter followed by linear
+#   interpolation of rFilter and rInterpolate. The anti-aliasing FIR filter is applied by scipy's resample_poly as part
+#   of the rate change, so the filtering and the rate change are one pass over the data.
+# The polyphase stage changes the nominal rate of the logger to a few times the output rate (see ratio) by a fixed
+#   rational ratio. What is left, the drift of the logger's clock from its nominal rate and the phase of the grid, is
+#   corrected by evaluating a short FIR filter between the samples of that oversampled signal at the time of each grid
+#   sample from the sector anchors (see rInterpolate.anchored_positions and _fractional_weights). Because the signal is
+#   already band limited and oversampled, a few taps are enough, without the droop of a linear interpolation.
+
+from fractions import Fraction
+from functools import lru_cache
+
+import numpy as np
+from scipy.signal import firwin, freqz, kaiserord, oaconvolve, resample_poly, upfirdn
+
+import Multithread
+import rFilter
+import rInterpolate as rInter
+
+POLY_OVERSAMPLE: int = 4  # Highest rate of the polyphase output, in multiples of the resample rate
+POLY_MIN_OVERSAMPLE: int = 2  # Lowest rate of the polyphase output, in multiples of the resample rate
+POLY_CUTOFF: float = 0.9  # Default anti-aliasing cutoff, of the Nyquist frequency of the slower of input and output
+POLY_ATTENUATION_DB: float = 60.0  # Stopband attenuation of the anti-aliasing filter
+POLY_MAX_DOWN: int = 64  # Largest downsampling factor of the rational ratio, the rest is left to the drift correction
+DECIMATE_OVERSAMPLE: int = 2  # The decimation stages stop at this multiple of the resample rate, or more
+DECIMATE_MIN_FACTOR: int = 4  # Smallest reduction by the decimation stages for the decimator to be worth using
+DECIMATE_MAX_STAGE: int = 5  # Largest downsampling factor of one decimation stage
+DECIMATE_PHASES: int = 2048  # Phases the last decimation filter is designed at, for outputs between its input samples
+DECIMATE_CHUNK: int = 1 << 14  # Output samples of the last stage at a time, each needs its taps' indices and weights
+
+
+def ratio(in_freq, out_freq):
+    """ Returns (up, down), the small rational ratio from the nominal input rate to between POLY_MIN_OVERSAMPLE and
+        POLY_OVERSAMPLE times out_freq, the highest that changes the rate. A pure downsample (up of 1) is preferred, it
+        can be filtered in FFT blocks. A ratio of one would filter at the full input rate and leave all of the rate
+        change to the interpolation, such as 800 Hz to 4 times 200 Hz"""
+    ratios = []
+    for oversample in range(POLY_OVERSAMPLE, POLY_MIN_OVERSAMPLE - 1, -1):
+        exact = Fraction(out_freq * oversample) / Fraction(in_freq)
+        ratios.append(exact.limit_denominator(POLY_MAX_DOWN))
+    changes = [r for r in ratios if r != 1] or [Fraction(1)]
+    approx = ([r for r in changes if r.numerator == 1] or changes)[0]
+    return (approx.numerator, approx.denominator)
+
+
+def cutoff(in_freq, out_freq, lowpass_freq=None):
+    """ The anti-aliasing cutoff in Hz, lowpass_freq if one is given and below the default"""
+    default = POLY_CUTOFF * min(in_freq, out_freq) / 2.0
+    return default if lowpass_freq is None else min(lowpass_freq, default)
+
+
+def stopband(in_freq, out_freq, cutoff_freq):
+    """ The start of the stopband in Hz of an anti-aliasing filter passing up to cutoff_freq. With the default cutoff,
+        the Nyquist frequency of the slower of input and output mirrored about the cutoff, so aliases only reach the
+        transition band. Below that, a transition band of (1 - POLY_CUTOFF) of the slower rate, so a lowpass_freq set
+        by the user is as sharp as the default"""
+    slower = min(in_freq, out_freq)
+    return min(slower - cutoff_freq, cutoff_freq + (1.0 - POLY_CUTOFF) * slower)
+
+
+def design(up, cutoff_freq, stop_freq, in_freq):
+    """ The Kaiser windowed FIR anti-aliasing filter at the upsampled rate up * in_freq, passing up to cutoff_freq and
+        stopping from stop_freq. Shared, so it must not be modified"""
+    return design_stage(up * in_freq, cutoff_freq, stop_freq)
+
+
+def resample(y, anchorIndex, anchorTime, grid, in_freq, lowpass_freq=None):
+    """ Resamples each channel (row) of y, recorded at a nominal in_freq Hz, onto grid (an rTime.Grid).
+        anchorIndex, anchorTime = the time axis of y from the sector anchors, see rapidCWA.sector_anchors
+        lowpass_freq = the anti-aliasing cutoff, default POLY_CUTOFF of the Nyquist frequency"""
+    out_freq = grid.freq
+    (up, down) = ratio(in_freq, out_freq)
+    cutoff_freq = cutoff(in_freq, out_freq, lowpass_freq)
+    stop_freq = stopband(in_freq, out_freq, cutoff_freq)
+    h = design(up, cutoff_freq, stop_freq, in_freq)
+    # The oversampled signal is already band limited, its filter only has to stop the images of the polyphase rate
+    rate = in_freq * up / down
+    table = _phase_table(rate, cutoff_freq, rate - stop_freq)
+    print("Polyphase Resample Start. Up", up, "down", down, "with", h.shape[0], "taps, cutoff", round(cutoff_freq, 2),
+          "Hz")
+
+    # The input sample index of each grid sample from the timestamps, scaled to the index in the polyphase output
+    inputPositions = rInter.anchored_positions(anchorIndex, anchorTime, grid, 1 / in_freq)
+    scale = up / down
+
+    def positions(k):
+        outSeq = inputPositions(k)
+        outSeq *= scale
+        return outSeq
+
+    oversampled = np.empty((y.shape[0], ), dtype=object)
+    Multithread.for_channels(_resample_channel, y.shape[0], y, oversampled, h, up, down, table.shape[1])
+    V = _interpolate_table(oversampled, table, positions, grid.numSamples)
+    print("Polyphase Resample Complete.")
+    return V
+
+
+def _resample_channel(i, y, oversampled, h, up, down, numtaps):
+    if up == 1:
+        # resample_poly filters directly, which for filters of hundreds of taps is several times slower than filtering
+        #   in FFT blocks and keeping every down'th sample. As resample_poly, about the line between the end samples
+        line = np.linspace(y[i, 0], y[i, -1], y.shape[1])
+        x = np.subtract(y[i], line)
+        x = oaconvolve(x, h, mode='same')[::down]
+        x += line[::down]
+    else:
+        x = resample_poly(y[i], up, down, window=h, padtype='line')
+    oversampled[i] = _pad(x, numtaps // 2)
+
+
+def decimation_stages(in_freq, out_freq):
+    """ The downsampling factor of each stage of a decimator from in_freq to DECIMATE_OVERSAMPLE or more times out_freq,
+        largest first. Empty when in_freq is not a whole multiple of out_freq, or the stages would reduce the rate by
+        less than DECIMATE_MIN_FACTOR"""
+    exact = Fraction(in_freq).limit_denominator(1000) / Fraction(out_freq).limit_denominator(1000)
+    if exact.denominator != 1:
+        return []
+    factor = exact.numerator
+
+    # The largest whole divisor of the ratio that leaves the oversampled rate
+    total = max([d for d in range(1, factor + 1) if factor % d == 0 and factor // d >= DECIMATE_OVERSAMPLE] or [1])
+    if total < DECIMATE_MIN_FACTOR:
+        return []
+
+    # Split into stages of at most DECIMATE_MAX_STAGE, the largest first where the filters are shortest
+    stages = []
+    for factor in range(DECIMATE_MAX_STAGE, 1, -1):
+        while total % factor == 0:
+            stages.append(factor)
+            total //= factor
+    if total != 1:
+        return []  # A prime factor too large to decimate in one stage
+    return stages
+
+
+@lru_cache(maxsize=rFilter.FILTER_CACHE_SIZE)
+def design_stage(in_freq, pass_freq, stop_freq, phases=1):
+    """ A Kaiser windowed FIR filter at in_freq Hz, passing up to pass_freq and stopping from stop_freq.
+        phases > 1 designs it at phases times the rate, for evaluating between samples (see _fractional_weights).
+        Shared, so it must not be modified"""
+    (numtaps, beta) = kaiserord(POLY_ATTENUATION_DB, (stop_freq - pass_freq) / (in_freq / 2.0))
+    if phases == 1:
+        numtaps |= 1  # Odd, so each kept sample is centred on an input sample
+        return firwin(numtaps, (pass_freq + stop_freq) / 2.0, window=('kaiser', beta), fs=in_freq)
+    numtaps += numtaps % 2  # Even taps per phase, as many either side of the output
+    h = firwin(numtaps * phases + 1, (pass_freq + stop_freq) / 2.0, window=('kaiser', beta), fs=in_freq * phases)
+    return h * phases
+
+
+@lru_cache(maxsize=rFilter.FILTER_CACHE_SIZE)
+def _phase_table(in_freq, pass_freq, stop_freq):
+    """ The final decimation filter arranged as table[p, j], the weight of tap j for an output p / DECIMATE_PHASES of a
+        sample after the input sample it follows, with one extra phase for an output on the next sample"""
+    h = design_stage(in_freq, pass_freq, stop_freq, DECIMATE_PHASES)
+    numtaps = (h.shape[0] - 1) // DECIMATE_PHASES
+    h = np.concatenate((h, np.zeros(DECIMATE_PHASES)))
+    p = np.arange(DECIMATE_PHASES + 1)[:, None]
+    j = np.arange(numtaps)[None, :]
+    table = h[p + (numtaps - 1 - j) * DECIMATE_PHASES]
+    table.flags.writeable = False
+    return table
+
+
+def decimate(y, anchorIndex, anchorTime, grid, in_freq, lowpass_freq=None):
+    """ As resample, for a nominal in_freq that is a whole multiple of the resample rate (see decimation_stages).
+        Each stage filters and downsamples with upfirdn, which only computes the samples it keeps. Each only has to stop
+        what would alias into the final band, so the filters are short. The sharp cutoff at the resample rate is the
+        last stage, at the lowest rate, evaluated only at the time of each grid sample from the sector anchors, which
+        also corrects the drift"""
+    out_freq = grid.freq
+    stages = decimation_stages(in_freq, out_freq)
+    cutoff_freq = cutoff(in_freq, out_freq, lowpass_freq)
+    # Aliasing from the last stage only reaches the transition band, above the cutoff
+    stop_freq = stopband(in_freq, out_freq, cutoff_freq)
+    print("Decimation Resample Start. Stages", stages, "cutoff", round(cutoff_freq, 2), "Hz")
+
+    (filters, rate) = _stage_filters(in_freq, stages, cutoff_freq)
+    table = _phase_table(rate, cutoff_freq, stop_freq)
+
+    # Decimated sample j is centred on input sample j * total
+    total = int(np.prod(stages))
+    inputPositions = rInter.anchored_positions(anchorIndex, anchorTime, grid, 1 / in_freq)
+
+    def positions(k):
+        outSeq = inputPositions(k)
+        outSeq /= total
+        return outSeq
+
+    decimated = np.empty((y.shape[0], ), dtype=object)
+    Multithread.for_channels(_decimate_channel, y.shape[0], y, decimated, filters, table.shape[1])
+    V = _interpolate_table(decimated, table, positions, grid.numSamples)
+    print("Decimation Resample Complete.")
+    return V
+
+
+def _stage_filters(in_freq, stages, cutoff_freq):
+    """ Returns (filters, rate), the (factor, filter) of each decimation stage and the rate after the last"""
+    filters = []
+    rate = in_freq
+    for factor in stages:
+        # Only what would alias into the passband has to be stopped here, the last stage removes the rest
+        filters.append((factor, design_stage(rate, cutoff_freq, rate / factor - cutoff_freq)))
+        rate /= factor
+    return (filters, rate)
+
+
+def gain_at(freq, in_freq, out_freq, lowpass_freq=None, engine='poly'):
+    """ The gain in dB at freq Hz of the anti-aliasing filters of resample (engine 'poly') or decimate (engine
+        'decimate'), as rFilter.gain_at for the lowpass filter of the linear resample"""
+    cutoff_freq = cutoff(in_freq, out_freq, lowpass_freq)
+    stop_freq = stopband(in_freq, out_freq, cutoff_freq)
+    filters = []  # Each filter and the rate it runs at
+    if engine == 'decimate':
+        rate = in_freq
+        for (factor, h) in _stage_filters(in_freq, decimation_stages(in_freq, out_freq), cutoff_freq)[0]:
+            filters.append((h, rate))
+            rate /= factor
+        filters.append((design_stage(rate, cutoff_freq, stop_freq), rate))
+    else:
+        (up, _) = ratio(in_freq, out_freq)
+        filters.append((design(up, cutoff_freq, stop_freq, in_freq), up * in_freq))
+
+    gain = 1.0
+    for (h, fs) in filters:
+        (_, response) = freqz(h, worN=[freq], fs=fs)
+        gain *= abs(response[0])
+    return float(20 * np.log10(max(gain, 1e-12)))
+
+
+def _decimate_channel(i, y, decimated, filters, numtaps):
+    x = y[i]
+    for (factor, h) in filters:
+        x = _decimate_stage(x, h, factor)
+    decimated[i] = _pad(x, numtaps // 2)
+
+
+def _pad(x, pad):
+    """ x with room either side for pad taps of the last stage, extended by odd reflection"""
+    return np.concatenate((2 * x[0] - x[pad:0:-1], x, 2 * x[-1] - x[-2:-(pad + 2):-1]))
+
+
+def _interpolate_table(channels, table, positions, numSamples):
+    """ Evaluates the filter of table (see _phase_table) on each padded channel at the fractional sample positions(k) of
+        the output samples k = 0 to numSamples - 1, a chunk of DECIMATE_CHUNK outputs at a time"""
+    V = np.empty((channels.shape[0], numSamples), dtype=np.float64)
+    for first in range(0, numSamples, DECIMATE_CHUNK):
+        k = np.arange(first, min(first + DECIMATE_CHUNK, numSamples))
+        (index, weights) = _fractional_weights(positions(k), table, channels[0].shape[0])
+        Multithread.for_channels(_apply_weights, channels.shape[0], channels, index, weights,
+                                 V[:, first:first + k.shape[0]])
+    return V
+
+
+def _decimate_stage(x, h, factor):
+    """ Filters x with h and keeps every factor'th sample, output sample j centred on x[j * factor].
+        The ends are extended by odd reflection, as sosfiltfilt pads"""
+    centre = (h.shape[0] - 1) // 2
+    before = centre + (-2 * centre) % factor  # Makes the first kept sample land on x[0]
+    padded = np.concatenate((2 * x[0] - x[before:0:-1], x, 2 * x[-1] - x[-2:-(centre + 2):-1]))
+    first = (before + centre) // factor
+    return upfirdn(h, padded, down=factor)[first:first + (x.shape[0] + factor - 1) // factor]
+
+
+def _fractional_weights(positions, table, length):
+    """ The first tap (index into the padded decimated channel) and the weights of the last stage for each output at a
+        fractional sample position, from the nearest phase of the table"""
+    pad = table.shape[1] // 2
+    limit = length - 2 * pad - 1
+    positions = np.clip(positions, 0, limit)
+    whole = np.minimum(positions.astype(np.int64), limit - 1)
+    p = np.rint((positions - whole) * DECIMATE_PHASES).astype(np.int64)
+    return (whole + 1, table[p])
+
+
+def _apply_weights(i, decimated, index, weights, V):
+    # Every output's taps as a row, a view of the channel until they are gathered
+    windows = np.lib.stride_tricks.sliding_window_view(decimated[i], weights.shape[1])
+    V[i] = np.einsum('ij,ij->i', windows[index], weights)
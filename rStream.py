@@ -0,0 +1,244 @@
+# Date 18 October 2026
+# Purpose: Out-of-core conversion of one logger. The read -> lowpass -> interpolate -> integrate -> write sequence of
+#   ConvertMain.compute_multi_channel is run as a chain of stages over blocks from rapidCWA.readBlocks, so that the peak
+#   memory is set by a memory budget rather than by the length of the recording. The budget covers the sample blocks
+#   and per-sector tables, not the interpreter itself or the file pages the operating system caches for the reader.
+# Every stage has push(start, block), taking the block of samples that starts at sample index start, and flush(), called
+#   once at the end of the stream. Both return a list of the (start, block) pieces that are ready for the next stage.
+#   Output matches the in-memory path exactly for plain conversion, resampling and integration. The zero-phase filters
+#   (rFilter.ZeroPhaseFilter) match to within the settling of the filter, around 1e-12 of full scale.
+
+import math
+import re
+import numpy as np
+
+import rapidCWA as rCWA
+import bin_data as BIN
+import rFilter
+import rIntegrate
+import rInterpolate as rInter
+import ProgressPrinter as pbar
+
+BLOCK_COPIES: int = 8  # Copies of a block that the stages can hold at once
+MIN_BLOCK_SAMPLES: int = 1 << 14
+SECTOR_STATE_BYTES: int = 64  # Per-sector plan, anchors and index held for the whole file by the reader
+SETTLE_TRANSIENTS: float = 3.0  # Lookahead of the zero-phase filters, in rFilter.transient_seconds
+
+
+def parse_memory(text):
+    """ Returns the number of bytes in a memory size such as "2G", "512M" or "1048576" """
+    match = re.fullmatch(r"\s*([0-9.]+)\s*([KMGT]?)i?B?\s*", str(text), re.IGNORECASE)
+    if match is None:
+        raise ValueError("Memory size not understood: " + str(text))
+    power = " KMGT".index(match.group(2).upper() or " ")
+    return int(float(match.group(1)) * (1024 ** power))
+
+
+def block_samples(maxMemory, numChannels, numSectors=0, margin=0):
+    """ The number of samples per block that keeps a conversion of numChannels channels within maxMemory bytes"""
+    available = maxMemory - numSectors * SECTOR_STATE_BYTES
+    samples = available // (numChannels * 8 * BLOCK_COPIES) - margin
+    if samples < MIN_BLOCK_SAMPLES:
+        print("[WARN]: A memory limit of", maxMemory, "bytes is too small to convert this logger, using",
+              MIN_BLOCK_SAMPLES, "sample blocks")
+        samples = MIN_BLOCK_SAMPLES
+    return int(samples)
+
+
+def filter_margin(order, cutoff_freq, in_freq):
+    """ Samples of lookahead a zero-phase filter needs to settle to the whole-array result"""
+    return int(math.ceil(SETTLE_TRANSIENTS * rFilter.transient_seconds(order, cutoff_freq) * in_freq))
+
+
+class Interpolator:
+    """ Linear interpolation of a stream onto the output samples given by positions(k) (see
+        rInterpolate.linear_positions). The last input sample of each block is carried to the next one so that output
+        samples falling between blocks are still found"""
+
+    def __init__(self, positions, numOutputs, numInputs, chunk=rCWA.BLOCK_SAMPLES):
+        self.positions = positions
+        self.numOutputs = numOutputs
+        self.numInputs = numInputs
+        self.chunk = chunk
+        self.carry = None
+        self.next = 0  # Next output sample
+
+    def _first_output(self, limit):
+        """ The first output sample from self.next on whose input position is at or after limit"""
+        lo = self.next
+        hi = self.numOutputs
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.positions(np.array([mid]))[0] < limit:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def push(self, start, block):
+        if self.carry is not None:
+            block = np.concatenate((self.carry, block), axis=1)
+            start -= self.carry.shape[1]
+        self.carry = block[:, -1:].copy()
+
+        # Every output sample needs the input samples either side of it
+        stop = start + block.shape[1]
+        end = self.numOutputs if stop >= self.numInputs else self._first_output(stop - 1)
+
+        pieces = []
+        for first in range(self.next, end, self.chunk):
+            outSeq = self.positions(np.arange(first, min(first + self.chunk, end)))
+            outSeq[outSeq >= self.numInputs] = self.numInputs - 2  # As interp1d
+            np.maximum(outSeq, 0, out=outSeq)
+            lo = outSeq.astype(np.int64)
+            B = np.subtract(outSeq, lo)
+            lo = np.clip(lo - start, 0, block.shape[1] - 2)
+            pieces.append((first, B * (block[:, lo + 1] - block[:, lo]) + block[:, lo]))
+        self.next = max(self.next, end)
+        return pieces
+
+    def flush(self):
+        return []
+
+
+class RangeSink:
+    """ The last stage of a first pass for 2 byte output, which needs the range of each channel before writing"""
+
+    def __init__(self, numChannels):
+        self.maxVal = np.full(numChannels, -np.inf)
+        self.minVal = np.full(numChannels, np.inf)
+
+    def push(self, start, block):
+        np.maximum(self.maxVal, block.max(axis=1), out=self.maxVal)
+        np.minimum(self.minVal, block.min(axis=1), out=self.minVal)
+        return []
+
+    def flush(self):
+        return []
+
+
+class ChannelWriter:
+    """ Writes each block straight to its place in the channel-major data block of the BIN file, as
+        rapidCWA.writeToFile would lay out the whole array"""
+
+    def __init__(self, filePath, offsetBytes, numSamples, scaleFactors, sizeBytes=8, ranges=None, writer=None):
+        self.ownWriter = writer is None
+        self.writer = BIN.BinWriter(filePath) if writer is None else writer
+        self.offsetBytes = offsetBytes
+        self.numSamples = numSamples
+        self.scaleFactors = scaleFactors
+        self.sizeBytes = sizeBytes
+        self.type = {8: 'float64', 4: 'float32', 2: 'uint16'}[sizeBytes]
+        self.header = 16 if sizeBytes == 2 else 0  # 2 byte channels start with their float64 min and max
+        self.stride = BIN.channel_bytes(numSamples, sizeBytes)
+
+        if sizeBytes == 2:
+            self.minVal = ranges.minVal / np.asarray(scaleFactors)
+            self.maxVal = ranges.maxVal / np.asarray(scaleFactors)
+            for i in range(len(scaleFactors)):
+                self.writer.write(offsetBytes + i * self.stride,
+                                  np.array([self.minVal[i], self.maxVal[i]], dtype='float64'))
+
+    def push(self, start, block):
+        block = block[:, :max(self.numSamples - start, 0)]
+        divisor = pow(2, 16-1) - 1
+        for i in range(block.shape[0]):
+            if self.sizeBytes == 2:
+                rangeVal = self.maxVal[i] - self.minVal[i]
+                data = ((block[i] / self.scaleFactors[i] - self.minVal[i])*(divisor/rangeVal)).astype(self.type)
+            else:
+                data = (block[i] / self.scaleFactors[i]).astype(self.type)
+            self.writer.write_samples(self.offsetBytes + i * self.stride + self.header, start, data)
+        return []
+
+    def flush(self):
+        if self.ownWriter:
+            self.writer.close()
+        return []
+
+    def end(self):
+        """ The file position after the last channel of this logger"""
+        return self.offsetBytes + len(self.scaleFactors) * self.stride
+
+
+def _push(stages, start, block):
+    """ Passes one block down the chain of stages"""
+    pieces = [(start, block)]
+    for stage in stages:
+        pieces = [out for (first, piece) in pieces for out in stage.push(first, piece)]
+
+
+def _run(blocks, stages, numInputs):
+    """ Streams the blocks through the stages, then flushes each stage in order into the stages after it"""
+    for (start, block, _) in blocks:
+        _push(stages, start, block)
+        done = min(100.0, 100.0 * (start + block.shape[1]) / max(numInputs, 1))
+        pbar.printProgressBar(done, 100, prefix="Stream", printEnd=" ")
+    for i, stage in enumerate(stages):
+        for (start, block) in stage.flush():
+            _push(stages[i + 1:], start, block)
+    print("")
+
+
+def convert_logger(filePath, loggerInfo, outputPath, offsetBytes, numSamples, axes, cols, maxMemory, sizeBytes=8,
+                   gaps='fill', segment=None, window=None, index=None, resample=None, lowpass_freq=None,
+                   highpass_freqs=None, writer=None, timing='anchors'):
+    """ Converts one logger (or one segment of it) into its place in the BIN file within maxMemory bytes.
+        numSamples = the number of samples of each channel in the BIN file
+        resample = the rTime.Grid to resample onto, None to convert the samples as recorded
+        lowpass_freq = the cutoff of the lowpass filter applied before resampling, None for no filter
+        highpass_freqs = (high1_freq, high2_freq) to integrate between two highpass filters, None to not integrate
+        writer = an open bin_data.WriteBehind to write through, None to write directly
+        timing = 'anchors' to resample against the sector timestamps, 'linear' against the mean rate of the data read
+        The other arguments are as rapidCWA.readToMem and rapidCWA.writeToFile. Returns the file position after the
+        last channel written"""
+    in_freq = float(loggerInfo.meanRate)
+    out_freq = in_freq if resample is None else resample.freq
+
+    margins = [0]
+    if resample is not None and lowpass_freq is not None:
+        margins.append(filter_margin(8, lowpass_freq, in_freq))
+    if highpass_freqs is not None:
+        margins += [filter_margin(8, freq, out_freq) for freq in highpass_freqs]
+    blockSize = block_samples(maxMemory, len(axes), loggerInfo.numSectors, max(margins))
+    print(" Streaming in blocks of", blockSize, "samples")
+
+    (anchorIndex, anchorTime, numInputs) = rCWA.readAnchors(filePath, loggerInfo=loggerInfo, gaps=gaps,
+                                                            segment=segment, window=window, index=index,
+                                                            returnSamples=True)
+
+    def stages():
+        chain = []
+        if resample is not None:
+            grid = resample
+            (startVal, endVal) = rCWA.sample_times(anchorIndex, anchorTime, [0, numInputs])
+            if lowpass_freq is not None:
+                chain.append(rFilter.ZeroPhaseFilter(rFilter.design('lowpass', 8, lowpass_freq, in_freq), margins[1]))
+            if timing == 'anchors':
+                (positions, numOutputs) = (rInter.anchored_positions(anchorIndex, anchorTime, grid, 1 / in_freq),
+                                           grid.numSamples)
+            else:
+                (positions, numOutputs) = rInter.linear_positions(startVal, endVal, numInputs, grid.start, grid.stop,
+                                                                  1 / grid.freq, grid.numSamples)
+            chain.append(Interpolator(positions, numOutputs, numInputs, chunk=blockSize))
+        if highpass_freqs is not None:
+            (high1_freq, high2_freq) = highpass_freqs
+            chain.append(rFilter.ZeroPhaseFilter(rFilter.design('highpass', 8, high1_freq, out_freq), margins[-2]))
+            chain.append(rIntegrate.Integrator(frequency=out_freq))
+            chain.append(rFilter.ZeroPhaseFilter(rFilter.design('highpass', 8, high2_freq, out_freq), margins[-1]))
+        return chain
+
+    def blocks():
+        return rCWA.readBlocks(filePath, loggerInfo=loggerInfo, cols=cols, gaps=gaps, segment=segment, window=window,
+                               index=index, axes=axes, blockSamples=blockSize)
+
+    # 2 byte output is scaled by the range of each channel, which is only known once every sample has been seen
+    ranges = None
+    if sizeBytes == 2:
+        ranges = RangeSink(len(axes))
+        _run(blocks(), stages() + [ranges], numInputs)
+
+    writer = ChannelWriter(outputPath, offsetBytes, numSamples, [rCWA.axis_scale(loggerInfo, axis) for axis in axes],
+                           sizeBytes, ranges, writer)
+    _run(blocks(), stages() + [writer], numInputs)
+    return writer.end()
@@ -0,0 +1,82 @@
+# Date 18 October 2026
+# Purpose: An exact time base for resampling. Times are whole nanoseconds since 1970 in python ints or int64 arrays, and
+#   sample rates are fractions, so the time of every sample of a resample grid, the number of samples between two
+#   times and the offset of any sample in the output are exact integers. Float seconds since 1970 only resolve about a
+#   quarter of a microsecond and lose more with every sum, which made the sample counts of long recordings depend on
+#   rounding. Floats are only used for times relative to a nearby origin, where they stay exact to the nanosecond.
+
+import math
+from fractions import Fraction
+
+import numpy as np
+
+NS_PER_SECOND: int = 1000000000
+NS_PER_DAY: int = 86400 * NS_PER_SECOND
+RATE_DENOMINATOR: int = 1000  # Largest denominator of a sample rate, rates are exact to the millihertz
+
+
+def to_ns(seconds):
+    """ Whole nanoseconds since 1970 of a time in float seconds since 1970, the whole and fractional seconds are
+        converted separately to keep all the precision the float has"""
+    whole = math.floor(seconds)
+    return int(whole) * NS_PER_SECOND + int(round((seconds - whole) * NS_PER_SECOND))
+
+
+def to_seconds(ns):
+    """ Float seconds since 1970 of a time in nanoseconds"""
+    return (ns // NS_PER_SECOND) + (ns % NS_PER_SECOND) / NS_PER_SECOND
+
+
+def rate(freq):
+    """ A sample rate in Hz as an exact fraction"""
+    return Fraction(freq).limit_denominator(RATE_DENOMINATOR)
+
+
+class Grid():
+    """ numSamples samples at rate Hz (a Fraction) from startNs nanoseconds since 1970. Sample k is at
+        startNs + k * 10^9 / rate, rounded down to the nanosecond"""
+
+    def __init__(self, startNs, freq, numSamples):
+        self.startNs = int(startNs)
+        self.rate = rate(freq)
+        self.numSamples = int(numSamples)
+        # The period in nanoseconds as whole + remainder / rate.numerator, so sample times need only int64 arithmetic
+        period = NS_PER_SECOND * self.rate.denominator
+        (self.periodWhole, self.periodRemainder) = divmod(period, self.rate.numerator)
+
+    @staticmethod
+    def between(startNs, stopNs, freq):
+        """ The grid at freq Hz starting at startNs with every sample up to and including stopNs"""
+        samples = rate(freq)
+        numSamples = ((stopNs - startNs) * samples.numerator) // (NS_PER_SECOND * samples.denominator) + 1
+        return Grid(startNs, samples, max(numSamples, 0))
+
+    def time_ns(self, k):
+        """ The time in nanoseconds since 1970 of sample k, an int or an int64 array"""
+        if isinstance(k, (int, np.integer)):
+            return self.startNs + (int(k) * self.periodWhole + (int(k) * self.periodRemainder) // self.rate.numerator)
+        k = np.asarray(k, dtype=np.int64)
+        return self.startNs + (k * self.periodWhole + (k * self.periodRemainder) // self.rate.numerator)
+
+    def offset_seconds(self, k, originNs, out=None):
+        """ The time of samples k (an int64 array) in float seconds after originNs nanoseconds since 1970"""
+        relative = self.time_ns(k) - originNs
+        return np.divide(relative, NS_PER_SECOND, out=out)
+
+    def dt_ms(self):
+        """ Milliseconds between samples"""
+        return float(1000 / self.rate)
+
+    @property
+    def freq(self):
+        return float(self.rate)
+
+    @property
+    def start(self):
+        """ Time of the first sample in float seconds since 1970"""
+        return to_seconds(self.startNs)
+
+    @property
+    def stop(self):
+        """ Time of the last sample in float seconds since 1970"""
+        return to_seconds(self.time_ns(max(self.numSamples - 1, 0)))
@@ -3,67 +3,484 @@
 # Purpose: Provide a massive speed upgrade for reading in CWA file types.
 #   Additionally handles the writing of the Catman BIN data from the sensors.
 # Last changed 6 July 2020, Adrian Shedley
+# Sectors are now memory mapped and decoded as one structured record array rather than one sector at a time.
+
+import os.path
 
 import numpy as np
 from datetime import datetime
 import ProgressPrinter as pbar
+import bin_data as BIN
 # Layout
-# 1) Load file
-# 2) File is read into memory
-# 3) File is operated on, converted to numpy array, and original is destroyed.
+# 1) Memory map file
+# 2) Sample payloads are exposed as a strided int16 view over the mapped file
+# 3) Only the requested channels are materialised to float64 when a processing stage needs them.
+
+# The 30 byte header found at the start of every data sector (see cwa_metadata.cwa_data for the field meanings)
+SECTOR_HEADER = [('packetHeader', '<u2'), ('packetLength', '<u2'), ('deviceFractional', '<u2'),
+                 ('sessionId', '<u4'), ('sequenceId', '<u4'), ('timestamp', '<u4'), ('light', '<u2'),
+                 ('temperature', '<u2'), ('events', 'u1'), ('battery', 'u1'), ('rateCode', 'u1'),
+                 ('numAxesBPS', 'u1'), ('timestampOffset', '<i2'), ('sampleCount', '<u2')]
+
+# A full data sector, 30 byte header + 480 byte sample payload + 2 byte checksum = 512 bytes
+SECTOR_DTYPE = np.dtype(SECTOR_HEADER + [('payload', 'u1', (480, )), ('checksum', '<u2')])
+
+# The sensors stored in each sample, in order, and the names of their axes, by the number of channels in the file
+SENSOR_AXES = {3: [('accel', ['X', 'Y', 'Z'])],
+               6: [('gyro', ['Gx', 'Gy', 'Gz']), ('accel', ['Ax', 'Ay', 'Az'])],
+               9: [('gyro', ['Gx', 'Gy', 'Gz']), ('accel', ['Ax', 'Ay', 'Az']), ('mag', ['Mx', 'My', 'Mz'])]}
+
+# The compact per-sector header fields kept in a logger index (see rIndex), enough for validation, timing and segments
+INDEX_DTYPE = np.dtype([('packetHeader', '<u2'), ('deviceFractional', '<u2'), ('sessionId', '<u4'),
+                        ('sequenceId', '<u4'), ('timestamp', '<u4'), ('events', 'u1'), ('rateCode', 'u1'),
+                        ('timestampOffset', '<i2')])
+
+# Default number of samples per block for the streaming reader, see readBlocks
+BLOCK_SAMPLES: int = 1 << 20
+
+# A continuous run of sectors in a file, see find_segments
+SEGMENT_DTYPE = np.dtype([('firstSector', '<i8'), ('lastSector', '<i8'), ('numSectors', '<i8'), ('gapSectors', '<i8'),
+                          ('startTime', '<f8'), ('stopTime', '<f8'), ('reason', 'U8')])
+
+
+def read_sectors(filePath, headerOffset=1024):
+    """ Memory maps all the data sectors of a .cwa file as one structured array of SECTOR_DTYPE records.
+        Nothing is read from disk until the records are accessed"""
+    sectors = (os.path.getsize(filePath) - headerOffset) // SECTOR_DTYPE.itemsize
+    if sectors <= 0:
+        return np.zeros((0, ), dtype=SECTOR_DTYPE)
+
+    return np.memmap(filePath, dtype=SECTOR_DTYPE, mode='r', offset=headerOffset, shape=(sectors, ))
+
+
+def sector_samples(sectors, numChannels, samplesPerSector):
+    """ Returns a zero-copy int16 view of the samples in all sectors, shape (sectors, samplesPerSector, numChannels).
+        The view strides over the sector headers and checksums directly in the (memory mapped) file"""
+    payload = sectors['payload'][:, :samplesPerSector * numChannels * 2]
+    return payload.view('<i2').reshape(sectors.shape[0], samplesPerSector, numChannels)
+
+
+def valid_sectors(sectors):
+    """ Returns a boolean mask of the sectors that are intact data sectors.
+        A sector is valid when it starts with "AX", has a packet length of 508 and its 16-bit words sum to zero"""
+    if sectors.shape[0] == 0:
+        return np.zeros((0, ), dtype=bool)
+
+    words = sectors.view('<u2').reshape(sectors.shape[0], SECTOR_DTYPE.itemsize // 2)
+    checksums = np.add.reduce(words, axis=1, dtype=np.uint16)  # Wraps around at 16 bits as per the CWA spec
+
+    return (checksums == 0) & (sectors['packetHeader'] == 0x5841) & (sectors['packetLength'] == 508)
+
+
+def sector_headers(sectors):
+    """ Copies the header fields of all sectors into a compact INDEX_DTYPE array"""
+    headers = np.empty(sectors.shape, dtype=INDEX_DTYPE)
+    for name in INDEX_DTYPE.names:
+        headers[name] = sectors[name]
+    return headers
+
+
+def sector_plan(valid, badSectors='fill'):
+    """ Returns the index of the source sector to use for each sector of output.
+        badSectors = 'fill' replaces a bad sector with the closest earlier good sector, keeping the timing intact
+                     'drop' removes bad sectors from the output
+                     'keep' uses every sector as is"""
+    allSectors = np.arange(valid.shape[0])
+    if badSectors == 'keep' or valid.all() or not valid.any():
+        return allSectors
+    if badSectors == 'drop':
+        return allSectors[valid]
+
+    plan = np.where(valid, allSectors, -1)
+    np.maximum.accumulate(plan, out=plan)
+    plan[plan < 0] = np.argmax(valid)  # Leading bad sectors take the first good sector
+    return plan
+
+
+def unpack_timestamps(values):
+    """ Vectorised cwa_metadata.read_timestamp, returns the seconds since 1970 of packed RTC values.
+        bit pattern:  YYYYYYMM MMDDDDDh hhhhmmmm mmssssss. Unknown or invalid dates are returned as NaN"""
+    values = values.astype(np.int64)
+    year = ((values >> 26) & 0x3f) + 2000
+    month = (values >> 22) & 0x0f
+    day = (values >> 17) & 0x1f
+    hours = (values >> 12) & 0x1f
+    mins = (values >> 6) & 0x3f
+    secs = values & 0x3f
+
+    valid = (month >= 1) & (month <= 12) & (day >= 1) & (hours < 24) & (mins < 60) & (secs < 60)
+    valid &= (values != 0x00000000) & (values != 0xffffffff)
+
+    months = ((year - 1970) * 12 + np.clip(month, 1, 12) - 1).astype('datetime64[M]')
+    days = months.astype('datetime64[D]').astype(np.int64) + np.maximum(day, 1) - 1
+
+    seconds = (days * 86400 + hours * 3600 + mins * 60 + secs).astype(np.float64)
+    seconds[~valid] = np.nan
+    return seconds
+
+
+def _header_times(sectors, index):
+    """ Returns (time, timestampOffset, frequency) of the given sectors, undoing the backwards-compatible fractional
+        timestamp shift in the same way as cwa_metadata.cwa_data"""
+    deviceFractional = sectors['deviceFractional'][index].astype(np.int64)
+    timestampOffset = sectors['timestampOffset'][index].astype(np.int64)
+    frequency = 3200 // (1 << (15 - (sectors['rateCode'][index].astype(np.int64) & 0x0f)))
+
+    # If the top bit is set, there is a 15-bit fractional part of the timestamp. Undo the backwards-compatible shift
+    #   applied to the timestampOffset as we have the true fraction
+    fractional = np.where(deviceFractional & 0x8000, (deviceFractional & 0x7fff) << 1, 0)
+    timestampOffset += (fractional * frequency) >> 16
+
+    time = unpack_timestamps(sectors['timestamp'][index]) + fractional / 65536
+    return (time, timestampOffset, frequency)
+
+
+def sector_anchors(sectors, plan, samplesPerSector):
+    """ Decodes the timestamp of every sector in one pass.
+        Returns (anchorIndex, anchorTime), the sample index in the output that each valid sector timestamp refers to and
+        the time of that sample in seconds since 1970. Both are strictly increasing"""
+    (anchorTime, timestampOffset, _) = _header_times(sectors, plan)
+    anchorIndex = (np.arange(plan.shape[0]) * samplesPerSector + timestampOffset).astype(np.float64)
+
+    # Only the first copy of each source sector is a real measurement, repeats are fills for bad sectors and gaps
+    keep = np.isfinite(anchorTime)
+    keep[1:] &= plan[1:] != plan[:-1]
+    anchorIndex = anchorIndex[keep]
+    anchorTime = anchorTime[keep]
+
+    # Drop any anchor that would make time run backwards, or stand still, relative to the anchors before it
+    if anchorTime.shape[0] > 1:
+        increasing = np.ones(anchorTime.shape, dtype=bool)
+        increasing[1:] = (anchorTime[1:] > np.maximum.accumulate(anchorTime)[:-1]) & \
+                         (anchorIndex[1:] > np.maximum.accumulate(anchorIndex)[:-1])
+        anchorIndex = anchorIndex[increasing]
+        anchorTime = anchorTime[increasing]
+
+    return (anchorIndex, anchorTime)
+
+
+def find_segments(sectors, valid, samplesPerSector):
+    """ Scans the sequence counters, session identifiers and resume events of all valid sectors for gaps, duplicates and
+        restarts. Returns (segments, duplicate), a SEGMENT_DTYPE table of the continuous runs of sectors in the file and a
+        mask of the sectors that repeat the one before them.
+        A segment covers the file sectors firstSector to lastSector inclusive, gapSectors is the number of sectors missing
+        between the previous segment and this one (from the sequence counter, or the timestamps after a restart)"""
+    duplicate = np.zeros(valid.shape, dtype=bool)
+    index = np.flatnonzero(valid)
+    if index.shape[0] == 0:
+        return (np.zeros((0, ), dtype=SEGMENT_DTYPE), duplicate)
+
+    sequence = sectors['sequenceId'][index].astype(np.int64)
+    session = sectors['sessionId'][index]
+
+    # The same packet written twice in a row
+    repeat = np.zeros(index.shape, dtype=bool)
+    repeat[1:] = (sequence[1:] == sequence[:-1]) & (session[1:] == session[:-1])
+    duplicate[index[repeat]] = True
+    index, sequence, session = index[~repeat], sequence[~repeat], session[~repeat]
+
+    resume = (sectors['events'][index] & 0x01) != 0  # b0 = resume logging
+    deltaSequence = np.diff(sequence)
+    # Sectors between each pair in the output, which never holds the duplicates, so a duplicate is not a missing sector
+    deltaIndex = np.diff(np.cumsum(~duplicate)[index])
+
+    restart = (session[1:] != session[:-1]) | (deltaSequence < 0) | resume[1:]
+    gap = ~restart & (deltaSequence > deltaIndex)
+
+    # Positions (in index) of the first sector of each segment
+    starts = np.concatenate(([0], np.flatnonzero(restart | gap) + 1))
+
+    # Missing sectors before each segment. After a restart the counter means nothing, so use the timestamps instead
+    (times, _, frequency) = _header_times(sectors, index)
+    period = samplesPerSector / frequency
+    previous = starts[1:] - 1
+    fromTimes = np.rint((times[starts[1:]] - times[previous]) / period[previous]) - deltaIndex[previous]
+    fromTimes = np.nan_to_num(fromTimes, nan=0.0)
+    gapSectors = np.zeros(starts.shape, dtype=np.int64)
+    gapSectors[1:] = np.where(gap[previous], deltaSequence[previous] - deltaIndex[previous], fromTimes)
+    gapSectors = np.maximum(gapSectors, 0)
+
+    segments = np.zeros(starts.shape, dtype=SEGMENT_DTYPE)
+    segments['firstSector'] = index[starts]
+    segments['firstSector'][0] = 0  # Leading bad sectors belong to the first segment
+    segments['lastSector'][:-1] = segments['firstSector'][1:] - 1
+    segments['lastSector'][-1] = valid.shape[0] - 1
+    segments['gapSectors'] = gapSectors
+    segments['startTime'] = times[starts]
+    segments['stopTime'] = times[np.concatenate((previous, [index.shape[0] - 1]))] + period[starts]
+    segments['reason'] = 'start'
+    segments['reason'][1:] = np.where(gap[previous], 'gap', 'restart')
+
+    return (segments, duplicate)
 
-def readToMem(filePath, loggerInfo=None, cols=['X', 'Y', 'Z']):
-    """ Reads all the data from a logger and returns a numpy array object"""
-    current_time = datetime.now().strftime("%H:%M:%S")
-    print("Read", filePath, "(", current_time, ")")
 
-    headerOffset = 1024
-    sectorSize = 512
-    samplesPerSector = loggerInfo['first']['samplesPerSector']
+def segment_plan(plan, duplicate, segments, gaps='fill', segment=None):
+    """ Applies a segment table to a sector plan (see sector_plan), removing duplicate sectors and then either
+        gaps = 'fill' holding the last sector before each gap for the number of missing sectors, keeping the timing intact
+               'join' joining the segments end to end as though there were no gaps
+        segment = only return the plan of this one segment of the table"""
+    positions = plan if plan.shape[0] != duplicate.shape[0] else np.arange(plan.shape[0])
+    keep = ~duplicate[positions]
+    plan, positions = plan[keep], positions[keep]
 
-    types = ['i2'] * len(cols)  # The 2byte integer layout
-    layout = np.dtype({'names': cols, 'formats': types})  # Name the columns of the array
+    if segment is not None:
+        inSegment = (positions >= segments['firstSector'][segment]) & (positions <= segments['lastSector'][segment])
+        return plan[inSegment]
 
-    fp = open(filePath, "rb")  # Open the file in read bytes mode
-    memmap = memoryview(fp.read())
-    fp.close()
+    if gaps == 'fill' and segments.shape[0] > 1 and plan.shape[0] > 0:
+        counts = np.ones(plan.shape, dtype=np.int64)
+        starts = np.searchsorted(positions, segments['firstSector'][1:])
+        counts[np.maximum(starts - 1, 0)] += segments['gapSectors'][1:]
+        plan = np.repeat(plan, counts)
 
-    fileSize = len(memmap)
-    sectors = (fileSize - headerOffset) // sectorSize
-    samples = sectors * samplesPerSector
+    return plan
 
-    masterArray = np.zeros((samples, ), dtype=layout)
 
-    for i in range(sectors):
-        #if i % (sectors // 4) == 0:
-            #print("Read ", round(100.0 * i / sectors, 1), "% complete")
-            #print(i/(sectors // 100))
-        if i % (sectors // 100) == 0:
-            pbar.printProgressBar(round((100.0 * i)/sectors, 0), 100, prefix="Read File", printEnd=" ")
+def sample_times(anchorIndex, anchorTime, indices):
+    """ Returns the time in seconds since 1970 of the given sample indices, linearly interpolated between sector anchors
+        and extrapolated at the mean rate of the file beyond the first and last anchor"""
+    indices = np.asarray(indices, dtype=np.float64)
+    times = np.interp(indices, anchorIndex, anchorTime)
 
-        imp = np.frombuffer(memmap[headerOffset + i * sectorSize : headerOffset + (i+1) * sectorSize - 2], offset=30, dtype=layout)
-        masterArray[i * samplesPerSector : (i+1) * samplesPerSector] = imp
+    if anchorIndex.shape[0] >= 2:
+        period = (anchorTime[-1] - anchorTime[0]) / (anchorIndex[-1] - anchorIndex[0])
+        before = indices < anchorIndex[0]
+        after = indices > anchorIndex[-1]
+        times[before] = anchorTime[0] + (indices[before] - anchorIndex[0]) * period
+        times[after] = anchorTime[-1] + (indices[after] - anchorIndex[-1]) * period
 
-    memmap.release()
+    return times
+
+
+def unpack_dword_samples(sectors, samplesPerSector, axis):
+    """ Decodes one axis of the packed DWORD format (bytesPerAxis == 0) for all sectors, shape (sectors, samplesPerSector)
+        Each sample is 32 bits, [3][2][1][0]: eezzzzzz zzzzyyyy yyyyyyxx xxxxxxxx, e = binary exponent.
+        Values are returned in the same raw int16 units as the 16-bit format"""
+    words = sectors['payload'][:, :samplesPerSector * 4].view('<u4')
+
+    # Place the 10 bit value in the top of a 16 bit word to sign extend it, then shift it back down by (6 - exponent)
+    shift = np.array(6, dtype=np.uint32) - (words >> 30)
+    if axis == 0:
+        value = words << 6
+    else:
+        value = words >> (10 * axis - 6)
+    value &= 0xffc0
+
+    return np.right_shift(value.astype(np.uint16).view(np.int16), shift.astype(np.int16))
+
+
+def sector_channel(sectors, loggerInfo, axis):
+    """ Returns the raw samples of a single axis for all sectors, shape (sectors, samplesPerSector).
+        This is a view onto the file for 16-bit formats and a vectorised decode for the packed format"""
+    samplesPerSector = loggerInfo.samplesPerSector
+
+    if loggerInfo.bytesPerAxis == 0:
+        return unpack_dword_samples(sectors, samplesPerSector, axis)
+    return sector_samples(sectors, loggerInfo.channels, samplesPerSector)[:, :, axis]
+
+
+def select_axes(numChannels, sensors=None):
+    """ Returns (axes, names), the index within each sample and the channel name of every axis of the chosen sensors.
+        sensors = a list of 'accel', 'gyro' and/or 'mag', or None for every sensor in the file"""
+    axes = []
+    names = []
+    for (i, (sensor, sensorNames)) in enumerate(SENSOR_AXES.get(numChannels, SENSOR_AXES[3])):
+        if sensors is None or sensor in sensors:
+            axes += [3 * i + j for j in range(len(sensorNames))]
+            names += sensorNames
+    return (axes, names)
+
+
+def axis_scale(loggerInfo, axis):
+    """ The raw units per engineering unit of one axis of a logger"""
+    if loggerInfo.channels >= 6:
+        return [loggerInfo.gyroScale, loggerInfo.accelScale, loggerInfo.magScale][axis // 3]
+    # The packed format is always decoded in units of 1/256 g, as in cwa_metadata.cwa_data
+    return loggerInfo.accelScale if loggerInfo.bytesPerAxis != 0 else loggerInfo.accelUnit
+
+
+def _sector_time(sectors, index, search=16):
+    """ Time of the first sector at or after index with a valid timestamp, looking at most search sectors ahead"""
+    for i in range(index, min(index + search, sectors.shape[0])):
+        if sectors['packetHeader'][i] == 0x5841:
+            time = _header_times(sectors, np.array([i]))[0][0]
+            if np.isfinite(time):
+                return time
+    return np.nan
+
+
+def find_sector(sectors, time):
+    """ Binary searches the sector timestamps for the first sector starting at or after time.
+        Only around log2(sectors) sector headers are read from the file"""
+    lo = 0
+    hi = sectors.shape[0]
+    while lo < hi:
+        mid = (lo + hi) // 2
+        midTime = _sector_time(sectors, mid)
+        if midTime < time or not np.isfinite(midTime):
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def window_sectors(sectors, window):
+    """ Returns the (first, last) range of sectors, last exclusive, that covers the (startTime, stopTime) window"""
+    (startTime, stopTime) = window
+    first = max(find_sector(sectors, startTime) - 1, 0)  # The sector before holds the samples leading up to startTime
+    last = min(find_sector(sectors, stopTime) + 1, sectors.shape[0])
+    return (first, max(last, first))
+
+
+def window_bytes(filePath, loggerInfo, window=None):
+    """ Returns the (start, stop) byte range of the file that the readers touch for a (startTime, stopTime) window,
+        the whole file if window is None. Only the sector headers of the binary search are read"""
+    if window is None:
+        return (0, os.path.getsize(filePath))
+    sectors = read_sectors(filePath, loggerInfo.headerSize)
+    (first, last) = window_sectors(sectors, window)
+    del sectors
+    return (loggerInfo.headerSize + first * SECTOR_DTYPE.itemsize, loggerInfo.headerSize + last * SECTOR_DTYPE.itemsize)
+
+
+def _load_sectors(filePath, loggerInfo, badSectors, gaps='fill', segment=None, window=None, index=None):
+    """ Maps the file, validates its sectors and finds its segments. If a (startTime, stopTime) window is given, only
+        the sectors covering that window are touched. If a sector index (see rIndex.sector_index) is given, validation,
+        timing and segments come from the index rather than the file.
+        Returns (sectors, headers, plan, segments, identity) where headers holds the sector header fields and identity
+        is True when the plan is every sector in order"""
+    samplesPerSector = loggerInfo.samplesPerSector
+    sectors = read_sectors(filePath, loggerInfo.headerSize)
+    headers = sectors if index is None else index['headers']
+
+    first = 0
+    last = sectors.shape[0]
+    if window is not None:
+        (first, last) = window_sectors(headers, window)
+        print(" Reading sectors", first, "to", last, "of", sectors.shape[0], "for the requested window")
+        sectors = sectors[first:last]
+        headers = headers[first:last]
+
+    valid = valid_sectors(sectors) if index is None else index['valid'][first:last]
+    numBad = valid.shape[0] - np.count_nonzero(valid)
+    if numBad > 0:
+        print("[WARN]:", numBad, "of", valid.shape[0], "sectors failed validation in", filePath, "(" + badSectors + ")")
+    plan = sector_plan(valid, badSectors)
+
+    (segments, duplicate) = find_segments(headers, valid, samplesPerSector)
+    if segments.shape[0] > 1 or duplicate.any():
+        print("[WARN]:", segments.shape[0] - 1, "gaps or restarts and", np.count_nonzero(duplicate),
+              "duplicate sectors in", filePath, "(" + gaps + ")")
+    plan = segment_plan(plan, duplicate, segments, gaps, segment)
+
+    # Number of sectors each segment contributes to the output, before any gap filling
+    kept = ~duplicate & (valid if badSectors == 'drop' else True)
+    if segments.shape[0] > 0:
+        segments['numSectors'] = np.add.reduceat(kept.astype(np.int64), segments['firstSector'])
+
+    identity = plan.shape[0] == sectors.shape[0] and (plan == np.arange(plan.shape[0])).all()
+
+    return (sectors, headers, plan, segments, identity)
+
+
+def readSegments(filePath, loggerInfo=None, badSectors='fill', index=None):
+    """ Reads only the sector headers of a logger and returns its segment table, see find_segments"""
+    (_, _, _, segments, _) = _load_sectors(filePath, loggerInfo, badSectors, gaps='join', index=index)
+    return segments
+
+
+def readAnchors(filePath, loggerInfo=None, badSectors='fill', gaps='fill', segment=None, window=None, index=None,
+                returnSamples=False):
+    """ Reads only the sector headers of a logger and returns the (anchorIndex, anchorTime) time axis, see sector_anchors
+        returnSamples = also return the number of samples readToMem would return, as (anchorIndex, anchorTime, samples)"""
+    (_, headers, plan, _, _) = _load_sectors(filePath, loggerInfo, badSectors, gaps, segment, window, index)
+    (anchorIndex, anchorTime) = sector_anchors(headers, plan, loggerInfo.samplesPerSector)
+    if returnSamples:
+        return (anchorIndex, anchorTime, plan.shape[0] * loggerInfo.samplesPerSector)
+    return (anchorIndex, anchorTime)
+
+
+def readToMem(filePath, loggerInfo=None, cols=['X', 'Y', 'Z'], badSectors='fill', gaps='fill', segment=None,
+              window=None, index=None, axes=None, returnTimes=False):
+    """ Reads all the data from a logger and returns a numpy array object
+        badSectors = how sectors that fail validation are handled, see sector_plan
+        gaps, segment = how gaps and restarts in the recording are handled, see segment_plan
+        window = (startTime, stopTime) in seconds since 1970, only decode the sectors that cover this time window
+        index = the sector index of this file from rIndex.sector_index, to skip validating and scanning the headers
+        axes = the index within each sample of the axis for each of cols (see select_axes), default the first len(cols)
+        returnTimes = also return the reconstructed time of every sample, as (masterArray, times)"""
+    current_time = datetime.now().strftime("%H:%M:%S")
+    print("Read", filePath, "(", current_time, ")")
+
+    samplesPerSector = loggerInfo.samplesPerSector
+    (sectors, headers, plan, _, identity) = _load_sectors(filePath, loggerInfo, badSectors, gaps, segment, window, index)
+
+    # Materialise each channel straight from the file into the float64 output, no intermediate whole-file copies
+    axes = axes if axes is not None else range(len(cols))
+    masterArray = np.empty((len(axes), plan.shape[0] * samplesPerSector), dtype=np.float64)
+    for i, axis in enumerate(axes):
+        channel = sector_channel(sectors, loggerInfo, axis)  # Unselected axes are never touched
+        masterArray[i].reshape(plan.shape[0], samplesPerSector)[:] = channel if identity else channel[plan]
+
+    if returnTimes:
+        (anchorIndex, anchorTime) = sector_anchors(headers, plan, samplesPerSector)
+        times = sample_times(anchorIndex, anchorTime, np.arange(masterArray.shape[1]))
+
+    del sectors, headers  # Release the file mapping
 
     current_time = datetime.now().strftime("%H:%M:%S")
     print("Read Complete. (", current_time, ")")
-    return masterArray.view(np.int16).reshape(masterArray.shape + (-1,)).transpose().astype(np.float64, casting='safe')
+    if returnTimes:
+        return (masterArray, times)
+    return masterArray
+
+def readBlocks(filePath, loggerInfo=None, cols=['X', 'Y', 'Z'], badSectors='fill', gaps='fill', segment=None,
+               window=None, index=None, axes=None, blockSamples=BLOCK_SAMPLES, overlap=0):
+    """ Streams the data of a logger as fixed size blocks rather than one array of the whole recording.
+        Yields (start, block, times), the output sample index of the first column of the block, the float64 block of
+        shape (len(cols), samples) and the reconstructed time of each of its samples in seconds since 1970.
+        Only the sector plan and the sector time anchors are held for the whole file, so memory is set by blockSamples.
+        blockSamples = samples per block, rounded down to whole sectors
+        overlap = the number of samples at the end of each block that are repeated at the start of the next one
+        The other arguments are as readToMem"""
+    samplesPerSector = loggerInfo.samplesPerSector
+    (sectors, headers, plan, _, _) = _load_sectors(filePath, loggerInfo, badSectors, gaps, segment, window, index)
+    (anchorIndex, anchorTime) = sector_anchors(headers, plan, samplesPerSector)
+    del headers
+
+    axes = axes if axes is not None else range(len(cols))
+    blockSectors = max(blockSamples // samplesPerSector, 1)
+    tail = np.zeros((len(axes), 0), dtype=np.float64)  # The overlap carried over from the previous block
 
-def writeToFile(arrayIn, filePath, loggerInfo=None, offsetBytes=0, sizeBytes=8, samples=0):
+    for first in range(0, plan.shape[0], blockSectors):
+        blockPlan = plan[first:first + blockSectors]
 
-    first = loggerInfo['first']
-    numChannels = first['channels']
+        # The plan only ever moves forwards, so each block reads one contiguous run of sectors from the file
+        low = blockPlan.min()
+        run = sectors[low:blockPlan.max() + 1]
+        block = np.empty((len(axes), tail.shape[1] + blockPlan.shape[0] * samplesPerSector), dtype=np.float64)
+        block[:, :tail.shape[1]] = tail
+        for i, axis in enumerate(axes):
+            channel = sector_channel(run, loggerInfo, axis)
+            block[i, tail.shape[1]:].reshape(blockPlan.shape[0], samplesPerSector)[:] = channel[blockPlan - low]
 
-    scaleFactors = []
-    if numChannels >= 6:
-        scaleFactors.append(first['gyroScale'])
-        scaleFactors.append(first['accelScale'])
-        if numChannels >= 9:
-            scaleFactors.append(first['magScale'])
-    elif numChannels >= 3:
-        scaleFactors.append(first['accelScale'])
+        start = first * samplesPerSector - tail.shape[1]
+        times = sample_times(anchorIndex, anchorTime, np.arange(start, start + block.shape[1]))
+        tail = block[:, block.shape[1] - min(overlap, block.shape[1]):].copy()
 
+        yield (start, block, times)
+
+    del sectors  # Release the file mapping
+
+
+def writeToFile(arrayIn, filePath, loggerInfo=None, offsetBytes=0, sizeBytes=8, samples=0, axes=None, writer=None):
+    """ Writes each row of arrayIn as a channel of the BIN file, scaled to engineering units.
+        axes = the axis within each logger sample that each row came from (see select_axes), default all of them
+        writer = an open bin_data.WriteBehind (or BinWriter) to hand the channels to, which may still be writing them
+            when this returns. Default opens a BinWriter and writes them before returning"""
+    axes = axes if axes is not None else range(loggerInfo.channels)
+    numChannels = len(axes)
+    scaleFactors = [axis_scale(loggerInfo, axis) for axis in axes]
 
     current_time = datetime.now().strftime("%H:%M:%S")
     print("Write Channel Start. (", current_time, ")")
@@ -71,7 +488,9 @@ def writeToFile(arrayIn, filePath, loggerInfo=None, offsetBytes=0, sizeBytes=8,
     if not filePath.endswith(".bin"):
         filePath += ".bin"
 
-    fp = open(filePath, 'ab+')
+    ownWriter = writer is None
+    if ownWriter:
+        writer = BIN.BinWriter(filePath)  # Positional writes, so the channels can go to their place in any order
 
     type = 'float64'
     divisor = 1
@@ -81,37 +500,33 @@ def writeToFile(arrayIn, filePath, loggerInfo=None, offsetBytes=0, sizeBytes=8,
         type = 'uint16'
         divisor = pow(2, 16-1) - 1
 
-    fp.seek(offsetBytes)
-
     # For 2 byte files, the method is slightly different
     # 8 byte float min
     # 8 byte float max
     # Data points between 0 and 2^(16-1)-1 for 2byte
+    stride = BIN.channel_bytes(samples, sizeBytes)
 
     for i in range(numChannels):
-        iScale = scaleFactors[i//3]  # First three channels take scaleFactor[0], 4-6 take scaleFactor[1] etc
+        iScale = scaleFactors[i]
+        channelPos = offsetBytes + i * stride
 
         if sizeBytes == 2:
             maxVal = arrayIn[i].max() / iScale
             minVal = arrayIn[i].min() / iScale
             rangeVal = maxVal - minVal
 
-            #print("File max at", arrayIn[i].argmax(), maxVal)
-            #print("File min at", arrayIn[i].argmin(), minVal)
-
             # Write the min and max values for catman to use
-            fp.write(minVal.astype('float64').tobytes())
-            fp.write(maxVal.astype('float64').tobytes())
+            writer.write(channelPos, np.array([minVal, maxVal], dtype='float64'))
 
             # Write the data in levels between 0 and [divisor]
-            fp.write(((arrayIn[i][:samples] / iScale - minVal)*(divisor/rangeVal)).astype(type).tobytes())
+            writer.write(channelPos + 16, ((arrayIn[i][:samples] / iScale - minVal)*(divisor/rangeVal)).astype(type))
         else:
-            fp.write((arrayIn[i][:samples]/ iScale).astype(type).tobytes())
-        #print("Logger Channel", cols[i], "written")
+            writer.write(channelPos, (arrayIn[i][:samples] / iScale).astype(type))
         pbar.printProgressBar((100.0 / numChannels) * (i + 1), 100, prefix="Write File", printEnd=" ")
 
-    lastPos = fp.tell()
-    fp.close()
+    lastPos = offsetBytes + numChannels * stride
+    if ownWriter:
+        writer.close()
 
     current_time = datetime.now().strftime("%H:%M:%S")
     print("Writing complete. (", current_time, ")")